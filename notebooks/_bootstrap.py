@@ -0,0 +1,8 @@
+import os
+import sys
+
+# --- Make project root importable as a package root (so 'src' works) ---
+HERE = os.path.dirname(os.path.abspath(__file__))          # .../ct-contrast-nw-gc-clahe/notebooks
+ROOT = os.path.abspath(os.path.join(HERE, ".."))           # .../ct-contrast-nw-gc-clahe
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
@@ -1,13 +1,6 @@
 #!/usr/bin/env python
 
-import os
-import sys
-
-# --- Make project root importable as a package root (so 'src' works) ---
-HERE = os.path.dirname(os.path.abspath(__file__))          # .../ct-contrast-nw-gc-clahe/notebooks
-ROOT = os.path.abspath(os.path.join(HERE, ".."))           # .../ct-contrast-nw-gc-clahe
-if ROOT not in sys.path:
-    sys.path.insert(0, ROOT)
+import _bootstrap  # noqa: F401  (project root on sys.path, so 'src' works)
 
 import numpy as np
 import matplotlib.pyplot as plt
@@ -17,6 +10,7 @@ import pydicom, imageio.v2 as iio
 from src.metrics.uiqi import uiqi
 from src.metrics.ssim_wrap import ssim01      # SSIM on [0,1]
 from src.metrics.fsim import fsim            # FSIM on [0,1]
+from src.utils.percentile import percentiles
 
 # --- loader for real image -> [0,1] with brain windowing (for metrics only) ---
 BRAIN_WL, BRAIN_WW = 40, 400  # use (50,130) for subdural if needed
@@ -39,7 +33,7 @@ def load_real_windowed(path, wl=BRAIN_WL, ww=BRAIN_WW):
         img = img.astype(np.float32)
         if img.max() > 1:
             img /= 255.0
-        lo, hi = np.percentile(img, 2), np.percentile(img, 98)
+        lo, hi = percentiles(img, (2, 98))
         x = np.clip(img, lo, hi)
         return (x - lo) / (hi - lo + 1e-8)
 
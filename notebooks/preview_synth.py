@@ -2,6 +2,9 @@ import numpy as np, matplotlib.pyplot as plt
 from pathlib import Path
 import pydicom, imageio.v2 as iio
 
+import _bootstrap  # noqa: F401  (project root on sys.path, so 'src' works)
+from src.utils.percentile import percentiles
+
 # --- simple loader for real image -> [0,1] with brain windowing ---
 BRAIN_WL, BRAIN_WW = 40, 80  # use (50,130) for subdural
 
@@ -22,7 +25,7 @@ def load_real_windowed(path, wl=BRAIN_WL, ww=BRAIN_WW):
         img = img.astype(np.float32)
         if img.max() > 1: img /= 255.0
         # percentile “window” for PNG/JPG
-        lo, hi = np.percentile(img, 2), np.percentile(img, 98)
+        lo, hi = percentiles(img, (2, 98))
         x = np.clip(img, lo, hi)
         return (x - lo) / (hi - lo + 1e-8)
 
@@ -0,0 +1,124 @@
+"""
+Volumetric CLAHE over a streamed series with a sliding slab.
+
+Slice-wise CLAHE builds each slice's tile LUTs from that slice alone, so
+the LUTs jump from one slice to the next and coronal / sagittal
+reformats show banding. Here the contextual region of a tile is the tile
+extended through a slab of ``slab`` slices centred on the current one
+(truncated at the ends of the series): the histogram is the sum of the
+tile's 2D histograms over the slab, the clip limit is relative to the
+slab's pixel count, and the LUTs are interpolated bilinearly in-plane as
+usual. Moving one slice along z adds one slice's histograms and drops
+another's, so the LUTs change by at most ``1/slab`` of their counts
+between neighbours.
+
+Slices are pulled from an iterator and each output is yielded as soon as
+the slab ahead of it is complete, ``slab // 2`` slices later. Only the
+slab's per-slice histograms and the slices waiting for their output are
+held, so memory is O(slab) whatever the series length. Incoming slices
+are histogrammed ``chunk`` at a time in one ``bincount`` pass.
+
+``slab=1`` is exactly the 2D ``clahe_multi``.
+"""
+from collections import deque
+
+import numpy as np
+
+from src.utils.trace import traced
+from .clahe_multi import (
+    quantize01, tile_pixels, tile_histograms, clip_luts, interpolate_luts,
+)
+
+
+@traced("slab_levels")
+def _slab_levels(q, acc, n, clips, tile_px, bins):
+    luts = clip_luts(acc, clips, tile_px * n, bins=bins)
+    return interpolate_luts(q, luts)
+
+
+def clahe_slab(qs, clips=(2.0,), tile=(8, 8), bins=256, slab=5, chunk=8):
+    """
+    Slab CLAHE of a series of integer slices, streamed.
+
+    Parameters
+    ----------
+    qs : iterable of np.ndarray
+        2D integer slices with values in [0, bins), in slice order. A
+        change of shape ends the series and starts a new one.
+    clips : sequence of float
+        Clip limits, cv2 semantics (relative to a flat histogram of the
+        slab's pixels in one contextual region).
+    tile : (int, int)
+        In-plane tile grid size.
+    bins : int
+        Number of grey levels / histogram bins.
+    slab : int
+        Slices per contextual region along z (odd; even values are
+        rounded up).
+    chunk : int
+        Slices histogrammed per pass.
+
+    Yields
+    ------
+    np.ndarray
+        float32 (len(clips), H, W) integer levels for each input slice, in
+        order.
+    """
+    half = max(int(slab), 1) // 2
+    chunk = max(int(chunk), 1)
+    qs = iter(qs)
+    window = deque()    # (index, histograms) of the slices in the slab
+    pending = deque()   # (index, slice) still waiting for their output
+    acc = None
+    shape = tile_px = carry = None
+    j = 0
+
+    def emit():
+        nonlocal acc
+        i, q = pending.popleft()
+        while window[0][0] < i - half:
+            acc -= window.popleft()[1]
+        return _slab_levels(q, acc, len(window), clips, tile_px, bins)
+
+    while True:
+        # up to ``chunk`` slices of one shape
+        block = [] if carry is None else [carry]
+        carry = None
+        for q in qs:
+            if block and q.shape != block[0].shape:
+                carry = q
+                break
+            block.append(q)
+            if len(block) == chunk:
+                break
+        if not block:
+            break
+        block = np.stack(block)
+        if block.shape[1:] != shape:
+            # a new slice shape starts a new series
+            while pending:
+                yield emit()
+            window.clear()
+            acc = None
+            shape = block.shape[1:]
+            tile_px = tile_pixels(shape, tile)
+        hists = tile_histograms(block, tile=tile, bins=bins)
+        for q, h in zip(block, hists):
+            window.append((j, h))
+            pending.append((j, q))
+            if acc is None:
+                acc = h.copy()
+            else:
+                acc += h
+            if pending[0][0] + half <= j:
+                yield emit()
+            j += 1
+    while pending:
+        yield emit()
+
+def clahe_stream(slices01, clip=2.0, tile=(8, 8), bins=256, slab=5, rnd=True, chunk=8):
+    """Plain slab CLAHE of a [0,1] series (``clahe_baseline`` rounding); yields [0,1] slices."""
+    qs = (quantize01(x, bins=bins, rnd=rnd) for x in slices01)
+    for out in clahe_slab(qs, clips=(clip,), tile=tile, bins=bins, slab=slab, chunk=chunk):
+        out /= float(bins - 1)
+        yield out[0]
@@ -1,9 +1,11 @@
 import numpy as np
-import cv2
+
+from .clahe_multi import clahe01
 
 def clahe_baseline(img01: np.ndarray,
                    clip: float = 2.0,
-                   tile=(8, 8)) -> np.ndarray:
+                   tile=(8, 8),
+                   bins: int = 256) -> np.ndarray:
     """
     Plain CLAHE baseline on a windowed image in [0,1].
 
@@ -15,14 +17,15 @@ def clahe_baseline(img01: np.ndarray,
         CLAHE clip limit.
     tile : (int, int)
         Tile grid size.
+    bins : int
+        Grey levels / histogram bins; 256 is the classic 8-bit CLAHE,
+        4096 or 65536 keep 12/16-bit precision. 256 and 65536 run on cv2's
+        CLAHE (uint8 / uint16 levels), other counts on ``clahe_multi``.
 
     Returns
     -------
     np.ndarray
         Enhanced image, float32 in [0,1].
     """
-    x = np.clip(img01.astype(np.float32), 0.0, 1.0)
-    u8 = np.uint8(np.round(x * 255.0))
-    clahe = cv2.createCLAHE(clipLimit=clip, tileGridSize=tile)
-    out = clahe.apply(u8)
-    return (out.astype(np.float32) / 255.0)
+    x = img01.astype(np.float32)
+    return clahe01(x, clip=clip, tile=tile, rnd=True, bins=bins)
@@ -0,0 +1,255 @@
+from functools import lru_cache
+
+import numpy as np
+import cv2
+
+from src.utils.trace import span, traced
+
+
+@traced()
+def quantize01(img01, bins=256, rnd=False):
+    """
+    Map a [0,1] image to integer levels 0..bins-1.
+
+    ``rnd=False`` truncates like the historical ``clahe01`` wrappers,
+    ``rnd=True`` rounds like ``clahe_baseline``.
+    """
+    x = np.clip(np.asarray(img01) * (bins - 1), 0, bins - 1)
+    if rnd:
+        x = np.round(x)
+    return x.astype(np.uint8 if bins <= 256 else np.uint16)
+
+
+def _grid(shape, tile):
+    """Padded shape and tile size in pixels, following OpenCV's CLAHE."""
+    h, w = shape
+    ty, tx = tile[1], tile[0]     # tileGridSize is (cols, rows) as in cv2
+    if h % ty or w % tx:
+        # cv2 pads both axes as soon as either one does not divide evenly
+        h, w = h + ty - h % ty, w + tx - w % tx
+    return (h, w), (h // ty, w // tx)
+
+
+def tile_pixels(shape, tile=(8, 8)):
+    """Number of pixels in one CLAHE contextual region for this image shape."""
+    (_, _), (sy, sx) = _grid(shape, tile)
+    return sy * sx
+
+
+@traced()
+def tile_histograms(q, tile=(8, 8), bins=256):
+    """
+    Per-tile histograms of an integer image or stack of images.
+
+    Parameters
+    ----------
+    q : np.ndarray
+        2D integer image, or (N, H, W) stack, with values in [0, bins).
+    tile : (int, int)
+        Tile grid size, same convention as ``cv2.createCLAHE``.
+    bins : int
+        Number of histogram bins.
+
+    Returns
+    -------
+    np.ndarray
+        int64 array of shape (tiles_y, tiles_x, bins), or
+        (N, tiles_y, tiles_x, bins) for a stack; a stack is counted in one
+        ``bincount`` pass.
+    """
+    (ph, pw), (sy, sx) = _grid(q.shape[-2:], tile)
+    h, w = q.shape[-2:]
+    if (ph, pw) != (h, w):
+        # OpenCV pads with BORDER_REFLECT_101 before building the LUTs
+        pad = ((0, 0),) * (q.ndim - 2) + ((0, ph - h), (0, pw - w))
+        q = np.pad(q, pad, mode="reflect")
+    ty, tx = ph // sy, pw // sx
+    tid = (np.arange(ph) // sy)[:, None] * tx + (np.arange(pw) // sx)[None, :]
+    lead = q.shape[:-2]
+    n = int(np.prod(lead))
+    # slice i's tiles occupy bins [i*ty*tx*bins, (i+1)*ty*tx*bins)
+    flat = tid * bins + q
+    if lead:
+        flat = flat + (np.arange(n) * (ty * tx * bins)).reshape(lead + (1, 1))
+    hist = np.bincount(flat.ravel(), minlength=n * ty * tx * bins)
+    return hist.reshape(lead + (ty, tx, bins))
+
+
+@traced()
+def clip_luts(hist, clips, tile_px, bins=256):
+    """
+    Clipped, redistributed and equalized LUTs for several clip limits.
+
+    Parameters
+    ----------
+    hist : np.ndarray
+        Tile histograms, shape (..., bins), as from ``tile_histograms``.
+    clips : sequence of float
+        CLAHE clip limits (cv2 semantics, relative to a flat histogram).
+    tile_px : int
+        Number of pixels that contributed to each tile histogram.
+    bins : int
+        Number of histogram bins.
+
+    Returns
+    -------
+    np.ndarray
+        float32 array of shape (len(clips), ..., bins) with values in
+        [0, bins-1].
+    """
+    scale = np.float32((bins - 1) / float(tile_px))
+    idx = np.arange(bins)
+    luts = []
+    for clip in clips:
+        h = hist.copy()
+        if clip > 0:
+            limit = max(int(clip * tile_px / bins), 1)
+            excess = np.maximum(h - limit, 0).sum(axis=-1, keepdims=True)
+            np.minimum(h, limit, out=h)
+            batch = excess // bins
+            residual = excess - batch * bins
+            h += batch
+            # the residual goes one count at a time to evenly spaced bins
+            step = np.maximum(bins // np.maximum(residual, 1), 1)
+            h += (idx % step == 0) & (idx // step < residual)
+        luts.append(np.round(np.cumsum(h, axis=-1).astype(np.float32) * scale))
+    return np.stack(luts).astype(np.float32)
+
+
+def _axis_weights(n, size, tiles):
+    """Neighbouring tile indices and bilinear weights along one axis."""
+    f = np.arange(n, dtype=np.float32) * np.float32(1.0 / size) - np.float32(0.5)
+    i1 = np.floor(f).astype(np.intp)
+    a = (f - i1).astype(np.float32)
+    i2 = np.minimum(i1 + 1, tiles - 1)
+    i1 = np.maximum(i1, 0)
+    return i1, i2, a
+
+
+@traced()
+def interpolate_luts(q, luts, origin=(0, 0), shape=None):
+    """
+    Bilinear interpolation of tile LUTs for every clip limit in one sweep.
+
+    Parameters
+    ----------
+    q : np.ndarray
+        2D integer image that the LUTs were built from, or a block of it.
+    luts : np.ndarray
+        Array of shape (K, tiles_y, tiles_x, bins) from ``clip_luts``.
+    origin : (int, int)
+        Row and column of ``q[0, 0]`` in the full image, for a block.
+    shape : (int, int), optional
+        Shape of the full image; defaults to ``q.shape``.
+
+    Returns
+    -------
+    np.ndarray
+        float32 array of shape (K, h, w), rounded to integer levels.
+    """
+    k, ty, tx, bins = luts.shape
+    full = q.shape if shape is None else tuple(shape)
+    (_, _), (sy, sx) = _grid(full, (tx, ty))
+    h, w = q.shape
+    r0, c0 = origin
+    y1, y2, ya = (a[r0:r0 + h] for a in _axis_weights(full[0], sy, ty))
+    x1, x2, xa = (a[c0:c0 + w] for a in _axis_weights(full[1], sx, tx))
+
+    # flat offsets of the four neighbouring LUT entries, shared by all K
+    i11 = (y1 * tx)[:, None] + x1[None, :]
+    i11 *= bins
+    i11 += q
+    i12 = i11 + ((x2 - x1) * bins)[None, :]
+    dy = ((y2 - y1) * tx * bins)[:, None]
+    i21 = i11 + dy
+    i22 = i12 + dy
+    xa, xa1 = xa[None, :], (1 - xa)[None, :]
+    ya, ya1 = ya[:, None], (1 - ya)[:, None]
+
+    # same operation order as cv2's CLAHE_Interpolation_Body
+    out = np.empty((k, h, w), dtype=np.float32)
+    for j in range(k):
+        lut = luts[j].ravel()
+        top = lut.take(i11)
+        top *= xa1
+        top += lut.take(i12) * xa
+        bot = lut.take(i21)
+        bot *= xa1
+        bot += lut.take(i22) * xa
+        top *= ya1
+        bot *= ya
+        np.add(top, bot, out=out[j])
+        np.round(out[j], out=out[j])
+    return out
+
+
+def clahe_multi(q, clips=(2.0,), tile=(8, 8), bins=256):
+    """
+    CLAHE of an integer image for several clip limits from one histogram pass.
+
+    Parameters
+    ----------
+    q : np.ndarray
+        2D integer image with values in [0, bins).
+    clips : sequence of float
+        Clip limits, cv2 semantics.
+    tile : (int, int)
+        Tile grid size.
+    bins : int
+        Number of grey levels / histogram bins.
+
+    Returns
+    -------
+    np.ndarray
+        float32 array of shape (len(clips), H, W) with integer levels in
+        [0, bins-1].
+    """
+    hist = tile_histograms(q, tile=tile, bins=bins)
+    luts = clip_luts(hist, clips, tile_pixels(q.shape, tile), bins=bins)
+    return interpolate_luts(q, luts)
+
+
+# bin counts at which ``cv2.createCLAHE`` is exactly the engine above:
+# OpenCV's CLAHE histograms 8-bit images in 256 bins and 16-bit images in
+# 65536, and is several times faster at both
+CV2_BINS = (256, 65536)
+
+
+@lru_cache(maxsize=32)
+def cv2_clahe(clip=2.0, tile=(8, 8)):
+    """
+    Cached ``cv2.CLAHE`` object. The cache is per process, so each pool
+    worker builds its own objects once and reuses them for every slice.
+    """
+    return cv2.createCLAHE(clipLimit=clip, tileGridSize=tuple(tile))
+
+
+def clahe_multi01(img01, clips=(2.0,), tile=(8, 8), rnd=False, bins=256):
+    """
+    Multi-clip CLAHE on a [0,1] image.
+
+    The image is quantized once. With ``bins`` in ``CV2_BINS`` (8- and
+    16-bit levels) each clip is one ``cv2.createCLAHE(clip, tile).apply``;
+    other bin counts (e.g. 4096 for 12-bit), which cv2 cannot histogram
+    natively, go through ``clahe_multi``, building the tile histograms
+    once for all clip limits. The output is scaled straight back to [0,1].
+
+    Returns
+    -------
+    list of np.ndarray
+        One float32 image in [0,1] per clip limit.
+    """
+    q = quantize01(img01, bins=bins, rnd=rnd)
+    if bins in CV2_BINS:
+        with span("clahe"):
+            return [cv2_clahe(clip, tuple(tile)).apply(q).astype(np.float32) / float(bins - 1)
+                    for clip in clips]
+    out = clahe_multi(q, clips=clips, tile=tile, bins=bins)
+    out /= float(bins - 1)
+    return list(out)
+
+
+@traced()
+def clahe01(img01, clip=2.0, tile=(8, 8), rnd=False, bins=256):
+    """Single-clip CLAHE on a [0,1] image (``clahe_multi01`` with one clip)."""
+    return clahe_multi01(img01, clips=(clip,), tile=tile, rnd=rnd, bins=bins)[0]
@@ -0,0 +1,68 @@
+from collections import namedtuple
+
+# A node is a stage name, its parameters and its input nodes. Nodes are
+# plain hashable tuples, so two methods that ask for the same stage with the
+# same parameters on the same inputs get the very same node.
+Node = namedtuple("Node", ["stage", "params", "inputs"])
+
+STAGES = {}
+
+
+def stage(name):
+    """Register ``fn(*inputs, **params)`` as the implementation of a stage."""
+    def register(fn):
+        STAGES[name] = fn
+        return fn
+    return register
+
+
+def node(stage_name, *inputs, **params):
+    return Node(stage_name, tuple(sorted(params.items())), tuple(inputs))
+
+
+def source(name="src"):
+    """Leaf node whose value is seeded by the caller."""
+    return Node(name, (), ())
+
+
+def label(n):
+    """Short human-readable form, e.g. ``clahe@clip=2.0``."""
+    if not n.params:
+        return n.stage
+    return n.stage + "@" + ",".join(f"{k}={v}" for k, v in n.params)
+
+
+class Executor:
+    """
+    Evaluate a set of target nodes, computing every distinct node once.
+
+    Parameters
+    ----------
+    seeds : dict
+        Values for the leaf nodes, e.g. ``{source(): img}``. Seeds are kept
+        apart from the cache so a bounded cache can never evict them.
+    cache : MutableMapping, optional
+        Where computed nodes are kept. Defaults to a fresh dict, i.e. reuse
+        within one slice only; pass a shared or bounded mapping to reuse
+        stages across calls.
+    """
+
+    def __init__(self, seeds, cache=None):
+        self.seeds = dict(seeds)
+        self.cache = {} if cache is None else cache
+        self.computed = []
+
+    def __getitem__(self, n):
+        if n in self.seeds:
+            return self.seeds[n]
+        if n in self.cache:
+            return self.cache[n]
+        args = [self[i] for i in n.inputs]
+        value = STAGES[n.stage](*args, **dict(n.params))
+        self.cache[n] = value
+        self.computed.append(n)
+        return value
+
+    def run(self, targets):
+        """Evaluate ``{name: node}`` and return ``{name: value}``."""
+        return {name: self[n] for name, n in targets.items()}
@@ -0,0 +1,263 @@
+"""
+Enhancement methods as graphs of named stages.
+
+Each method in ``METHODS`` maps a windowed-image node to its output node.
+Building several methods on the same input and running them through one
+``Executor`` computes shared stages (NGC, quantization, CLAHE at a given
+clip and, at bit depths cv2 cannot take, the tile histograms) once per
+slice.
+
+``STREAMS`` holds the slab (3D CLAHE) counterparts and ``SERIES`` the
+incremental ones (statistics carried between slices, ``series``); both
+enhance a whole series as a stream of slices instead of one slice at a
+time.
+"""
+from itertools import tee
+
+import numpy as np
+
+from src.io.dicom_png import window_hu, window_hu_levels, window_img01
+from src.utils import degrade, degrade_v2
+from src.utils.trace import traced
+from .graph import node, source, stage
+from .ngc import ngc
+from .clahe_multi import (
+    CV2_BINS, cv2_clahe, quantize01, tile_pixels, tile_histograms, clip_luts,
+    interpolate_luts,
+)
+from .nw_gc_clahe import (
+    edge_map, noise_map, weight_map, blend, coarse_maps, nw_gc_clahe_stream,
+)
+from .ngc_clahe import ngc_clahe_stream
+from .clahe3d import clahe_stream
+from .tiled import nw_gc_clahe_tiled
+from .series import clahe_series, ngc_clahe_series, nw_gc_clahe_series
+
+
+@stage("window")
+def _window(src, kind="npy", wl=40, ww=400):
+    if kind == "hu":
+        return window_hu(src, wl, ww)
+    if kind == "pct":
+        return window_img01(src)
+    img01 = src.astype(np.float32)
+    # in case someone saved as 0-255 by mistake
+    if img01.max() > 1.001:
+        img01 = img01 / 255.0
+    return np.clip(img01, 0.0, 1.0)
+
+
+@stage("levels")
+def _levels(hu, wl=40, ww=400, bits=12):
+    return window_hu_levels(hu, wl, ww, bits=bits)
+
+
+@stage("degrade")
+def _degrade(x, strength="strong", version=1):
+    fn = degrade_v2 if version == 2 else degrade
+    return fn.degrade_low_contrast(x, strength=strength)
+
+
+@stage("ngc")
+def _ngc(x, gamma=0.95):
+    return ngc(x, gamma=gamma)
+
+
+@stage("quantize")
+def _quantize(x, rnd=False, bins=256):
+    # integer input is taken as ready-made levels (e.g. window_hu_levels)
+    return x if x.dtype.kind in "ui" else quantize01(x, bins=bins, rnd=rnd)
+
+
+@stage("clahe")
+@traced("clahe")
+def _clahe(q, clip=2.0, tile=(8, 8), bins=256):
+    return cv2_clahe(clip, tuple(tile)).apply(q).astype(np.float32) / float(bins - 1)
+
+
+@stage("hist")
+def _hist(q, tile=(8, 8), bins=256):
+    return q, tile_histograms(q, tile=tile, bins=bins), tile_pixels(q.shape, tile)
+
+
+@stage("clahe_hist")
+def _clahe_hist(h, clip=2.0):
+    q, hist, tile_px = h
+    bins = hist.shape[-1]
+    luts = clip_luts(hist, (clip,), tile_px, bins=bins)
+    return interpolate_luts(q, luts)[0] / float(bins - 1)
+
+
+@stage("edge")
+def _edge(x):
+    return edge_map(x)
+
+
+@stage("noise")
+def _noise(x, E, k=7):
+    return noise_map(x, k=k, edge=E)
+
+
+@stage("weight")
+def _weight(E, N, alpha=0.8, beta=0.6, delta=0.2):
+    return weight_map(E, N, alpha=alpha, beta=beta, delta=delta)
+
+
+@stage("coarse_weight")
+def _coarse_weight(x, level=1, k=7, alpha=0.8, beta=0.6, delta=0.2):
+    return coarse_maps(x, level, k=k, alpha=alpha, beta=beta, delta=delta)[2]
+
+
+@stage("blend")
+def _blend(W, agg, cons):
+    return blend(W, agg, cons)
+
+
+@stage("tiled")
+def _tiled(x, **params):
+    return nw_gc_clahe_tiled(x, **params)
+
+
+def clahe_node(x, clip=2.0, tile=(8, 8), rnd=False, bins=256):
+    """
+    CLAHE of ``x``: cv2 at the bit depths it handles exactly
+    (``CV2_BINS``), else tile histograms shared by every clip on the same
+    levels.
+    """
+    q = node("quantize", x, rnd=rnd, bins=bins)
+    if bins in CV2_BINS:
+        return node("clahe", q, clip=clip, tile=tile, bins=bins)
+    return node("clahe_hist", node("hist", q, tile=tile, bins=bins), clip=clip)
+
+
+def clahe_method(x, clip=2.0, tile=(8, 8), bins=256, levels=None):
+    # plain CLAHE needs no float stage, so it can start from integer levels
+    src = x if levels is None else levels
+    return clahe_node(src, clip=clip, tile=tile, rnd=True, bins=bins)
+
+
+def ngc_clahe_method(x, gamma=0.95, clip=2.0, tile=(8, 8), bins=256):
+    g = node("ngc", x, gamma=gamma)
+    return clahe_node(g, clip=clip, tile=tile, bins=bins)
+
+
+def nw_gc_clahe_method(x, gamma=0.95, clip_cons=1.0, clip_agg=3.0,
+                       tile=(8, 8), alpha=0.8, beta=0.6, delta=0.2, bins=256,
+                       budget_mb=None, w_level=0):
+    if budget_mb:
+        # block-wise in bounded memory; one stage, nothing shared
+        return node("tiled", x, gamma=gamma, clip_cons=clip_cons, clip_agg=clip_agg,
+                    tile=tile, alpha=alpha, beta=beta, delta=delta, bins=bins,
+                    budget_mb=budget_mb)
+    g = node("ngc", x, gamma=gamma)
+    cons = clahe_node(g, clip=clip_cons, tile=tile, bins=bins)
+    agg = clahe_node(g, clip=clip_agg, tile=tile, bins=bins)
+    if w_level:
+        # approximate: maps on a pyramid level, W upsampled
+        W = node("coarse_weight", g, level=w_level, k=7, alpha=alpha, beta=beta, delta=delta)
+    else:
+        E = node("edge", g)
+        N = node("noise", g, E, k=7)
+        W = node("weight", E, N, alpha=alpha, beta=beta, delta=delta)
+    return node("blend", W, agg, cons)
+
+
+# output suffix -> graph builder, with the settings used in the paper runs
+METHODS = {
+    "clahe": clahe_method,
+    "ngcclahe": ngc_clahe_method,
+    "proposed": nw_gc_clahe_method,
+}
+
+
+def _nw_gc_clahe_stream(slices01, **kw):
+    return (out for out, _ in nw_gc_clahe_stream(slices01, **kw))
+
+
+# the same methods with ``slab``-deep contextual regions, as
+# ``fn(iterable of [0,1] slices, slab=..., **params) -> iterator``
+STREAMS = {
+    "clahe": clahe_stream,
+    "ngcclahe": ngc_clahe_stream,
+    "proposed": _nw_gc_clahe_stream,
+}
+
+
+def _nw_gc_clahe_series(slices01, **kw):
+    return (out for out, _ in nw_gc_clahe_series(slices01, **kw))
+
+
+# the same methods with normalisation statistics and tile histograms
+# carried along the series, as ``fn(iterable, mode=..., window=..., **params)``
+SERIES = {
+    "clahe": clahe_series,
+    "ngcclahe": ngc_clahe_series,
+    "proposed": _nw_gc_clahe_series,
+}
+
+# column suffixes used in metrics_per_slice.csv
+LABELS = {"clahe": "CLAHE", "ngcclahe": "NGC", "proposed": "PROP"}
+
+
+def build(names, x, params=None):
+    """
+    Output nodes for the selected methods.
+
+    Parameters
+    ----------
+    names : iterable of str
+        Keys of ``METHODS``.
+    x : Node
+        Windowed image node in [0,1].
+    params : dict, optional
+        Per-method keyword overrides, ``{name: {param: value}}``.
+    """
+    params = params or {}
+    return {n: METHODS[n](x, **params.get(n, {})) for n in names}
+
+
+def build_slice(names, kind="npy", wl=40, ww=400, bits=8, budget_mb=None, w_level=0):
+    """
+    Source and output nodes for the selected methods on one raw slice.
+
+    Windowing is the first stage. Above 8 bits, DICOM HU go straight to
+    integer levels for plain CLAHE. ``budget_mb`` / ``w_level`` select the
+    block-wise or preview form of the proposed method.
+
+    Returns
+    -------
+    (Node, dict)
+        Source node to seed with the raw slice, ``{name: output node}``.
+    """
+    src = source()
+    x = node("window", src, kind=kind, wl=wl, ww=ww)
+    params = {n: {"bins": 1 << bits} for n in names}
+    if kind == "hu" and bits > 8 and "clahe" in params:
+        params["clahe"]["levels"] = node("levels", src, wl=wl, ww=ww, bits=bits)
+    if budget_mb and "proposed" in params:
+        params["proposed"]["budget_mb"] = budget_mb
+    if w_level and "proposed" in params:
+        params["proposed"]["w_level"] = w_level
+    return src, build(names, x, params)
+
+
+def stream(names, slices01, params=None, streams=STREAMS, **kw):
+    """
+    Outputs of the selected methods over one series, from ``streams``
+    (``STREAMS`` with ``slab=...``, or ``SERIES`` with ``mode=...``,
+    ``window=...`` as ``kw``).
+
+    ``slices01`` is iterated once; each method gets its own copy of the
+    stream (``itertools.tee``), and since every method lags by the same
+    number of slices only a few slices are buffered between them.
+
+    Returns
+    -------
+    iterator of dict
+        ``{name: enhanced slice}`` per input slice, in order.
+    """
+    params = params or {}
+    names = list(names)
+    its = tee(slices01, len(names))
+    outs = [streams[n](it, **kw, **params.get(n, {})) for n, it in zip(names, its)]
+    return (dict(zip(names, imgs)) for imgs in zip(*outs))
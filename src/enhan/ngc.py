@@ -1,5 +1,7 @@
 import numpy as np
+from src.utils.trace import traced
 
+@traced()
 def ngc(img01, gamma=0.95):
     g = np.clip(img01, 0, 1) ** float(gamma)
     gmin, gmax = g.min(), g.max()
@@ -1,12 +1,18 @@
-import numpy as np, cv2
 from .ngc import ngc
+from .clahe_multi import clahe01, quantize01
+from .clahe3d import clahe_slab
 
-def clahe01(img01, clip=2.0, tile=(8,8)):
-    u8 = np.uint8(np.clip(img01*255, 0, 255))
-    out = cv2.createCLAHE(clipLimit=clip, tileGridSize=tile).apply(u8)
-    return out.astype(np.float32)/255.0
-
-def ngc_clahe(img01, gamma=0.95, clip=2.0, tile=(8,8)):
+def ngc_clahe(img01, gamma=0.95, clip=2.0, tile=(8,8), bins=256):
     x = ngc(img01, gamma=gamma)
-    return clahe01(x, clip=clip, tile=tile)
+    return clahe01(x, clip=clip, tile=tile, bins=bins)
 
+def ngc_clahe_stream(slices01, gamma=0.95, clip=2.0, tile=(8,8), bins=256, slab=5):
+    """
+    ngc_clahe over a series with contextual regions ``slab`` slices deep
+    (see ``clahe3d``); takes any iterable of slices and yields the
+    enhanced slices in order, holding O(slab) of them.
+    """
+    qs = (quantize01(ngc(x, gamma=gamma), bins=bins) for x in slices01)
+    for out in clahe_slab(qs, clips=(clip,), tile=tile, bins=bins, slab=slab):
+        out /= float(bins - 1)
+        yield out[0]
@@ -1,37 +1,122 @@
-import numpy as np, cv2
+from collections import deque
+
+import cv2
+import numpy as np
 from skimage.filters import sobel
 from scipy.ndimage import uniform_filter
 from .ngc import ngc
+from .clahe_multi import clahe01, clahe_multi01, quantize01
+from .clahe3d import clahe_slab
+from src.utils.trace import traced
 
-def clahe01(img01, clip=2.0, tile=(8,8)):
-    u8 = np.uint8(np.clip(img01*255, 0, 255))
-    out = cv2.createCLAHE(clipLimit=clip, tileGridSize=tile).apply(u8)
-    return out.astype(np.float32)/255.0
+def edge_magnitude(img01):
+    # edge_map before its min/max normalisation
+    return np.abs(sobel(img01))
 
+@traced()
 def edge_map(img01):
-    e = np.abs(sobel(img01))
+    e = edge_magnitude(img01)
     e = (e - e.min()) / (e.max()-e.min()+1e-8)
     return e
 
-def noise_map(img01, k=7, edge=None):
+def local_variance(img01, k=7, edge=None):
+    # noise_map before its min/max normalisation
     m  = uniform_filter(img01, size=k)
     m2 = uniform_filter(img01*img01, size=k)
     var = np.maximum(m2 - m*m, 0.0)
     z = var
     if edge is not None:
         z = z * (1.0 - edge)  # emphasize flat-noisy
+    return z
+
+@traced()
+def noise_map(img01, k=7, edge=None):
+    z = local_variance(img01, k=k, edge=edge)
     z = (z - z.min())/(z.max()-z.min()+1e-8)
     return z
 
+@traced()
+def weight_map(E, N, alpha=0.8, beta=0.6, delta=0.2):
+    return np.clip(alpha*E - beta*N + delta, 0.0, 1.0)
+
+@traced()
+def blend(W, agg, cons):
+    return W*agg + (1.0-W)*cons
+
+# Bound on |delta| of UIQI / SSIM against the clean reference between
+# w_level=L and the exact path. Worst seen: level 1 3.8e-3 / 3.1e-3,
+# level 2 2.2e-2 / 4.0e-3 (UIQI is worst on the flat Shepp-Logan
+# phantom); checked on phantoms by ``python -m src.run_bench accuracy``.
+W_LEVEL_BOUNDS = {1: (5e-3, 5e-3), 2: (3e-2, 1e-2)}
+
+
+def coarse_maps(x, level=1, k=7, alpha=0.8, beta=0.6, delta=0.2):
+    """
+    E, N and W on pyramid level ``level`` of ``x`` (``cv2.pyrDown``
+    ``level`` times), with the noise window shrunk to keep its footprint;
+    W is upsampled bilinearly to ``x``'s shape, E and N stay coarse.
+    """
+    s = x
+    for _ in range(level):
+        s = cv2.pyrDown(s)
+    E = edge_map(s)
+    N = noise_map(s, k=max(3, (k >> level) | 1), edge=E)
+    W = weight_map(E, N, alpha=alpha, beta=beta, delta=delta)
+    W = cv2.resize(W, x.shape[::-1], interpolation=cv2.INTER_LINEAR)
+    return E, N, W
+
+
 def nw_gc_clahe(img01, gamma=0.95,
                 clip_cons=1.0, clip_agg=3.0, tile=(8,8),
-                alpha=0.8, beta=0.6, delta=0.2):
+                alpha=0.8, beta=0.6, delta=0.2, bins=256, w_level=0):
+    """
+    Noise- and window-aware NGC-CLAHE; returns out, (E, N, W).
+
+    ``w_level > 0`` is the approximate preview mode: the edge, noise and
+    weight maps are computed ``w_level`` pyramid levels down and W is
+    upsampled for the full-resolution blend (``coarse_maps``; E and N are
+    then returned at the coarse size). Metric deltas against the exact
+    path stay within ``W_LEVEL_BOUNDS``. Level 1 runs about 1.7x faster;
+    NGC and CLAHE, still at full resolution, are most of what is left.
+    """
     x = ngc(img01, gamma=gamma)
+    # one quantization shared by both clip limits
+    cons, agg = clahe_multi01(x, clips=(clip_cons, clip_agg), tile=tile, bins=bins)
+    if w_level > 0:
+        E, N, W = coarse_maps(x, w_level, k=7, alpha=alpha, beta=beta, delta=delta)
+        return blend(W, agg, cons), (E, N, W)
     E = edge_map(x)
     N = noise_map(x, k=7, edge=E)
-    cons = clahe01(x, clip=clip_cons, tile=tile)
-    agg  = clahe01(x, clip=clip_agg,  tile=tile)
-    W = np.clip(alpha*E - beta*N + delta, 0.0, 1.0)
-    out = W*agg + (1.0-W)*cons
+    W = weight_map(E, N, alpha=alpha, beta=beta, delta=delta)
+    out = blend(W, agg, cons)
     return out, (E, N, W)
 
+
+
+# --- series ---
+
+def nw_gc_clahe_stream(slices01, gamma=0.95,
+                       clip_cons=1.0, clip_agg=3.0, tile=(8,8),
+                       alpha=0.8, beta=0.6, delta=0.2, bins=256, slab=5):
+    """
+    nw_gc_clahe over a series with contextual regions ``slab`` slices deep
+    (see ``clahe3d``). Takes any iterable of slices and yields
+    ``out, (E, N, W)`` per slice in order; the edge / noise / weight maps
+    stay per slice, and only the slices inside the slab are held.
+    """
+    maps = deque()   # (E, N, W) of slices whose CLAHE is not out yet
+
+    def levels():
+        for img01 in slices01:
+            x = ngc(img01, gamma=gamma)
+            E = edge_map(x)
+            N = noise_map(x, k=7, edge=E)
+            maps.append((E, N, weight_map(E, N, alpha=alpha, beta=beta, delta=delta)))
+            yield quantize01(x, bins=bins)
+
+    for cons, agg in clahe_slab(levels(), clips=(clip_cons, clip_agg),
+                                tile=tile, bins=bins, slab=slab):
+        cons /= float(bins - 1)
+        agg /= float(bins - 1)
+        E, N, W = maps.popleft()
+        yield blend(W, agg, cons), (E, N, W)
@@ -0,0 +1,155 @@
+"""
+Parameter sweeps over ``nw_gc_clahe`` with shared intermediate stages.
+
+Every grid point is built as a ``nw_gc_clahe_method`` graph on the same
+input node and run through one ``Executor`` whose cache is a bounded
+``LRUCache``. Grid points that share a parameter share the node for it:
+NGC depends only on gamma, the edge / noise maps only on the NGC image,
+each CLAHE only on (gamma, tile, clip) and W only on (alpha, beta, delta).
+A grid therefore costs one CLAHE pass per distinct (gamma, clip) instead
+of two per point.
+
+The grid is enumerated with gamma outermost so that everything built from
+one NGC image is used up before the next one is computed, which keeps the
+working set small enough for a modest cache.
+"""
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from itertools import product
+
+import numpy as np
+
+from src.metrics.engine import MetricsEngine
+from .graph import Executor, source
+from .methods import nw_gc_clahe_method
+
+# sweepable nw_gc_clahe parameters, in enumeration order (outermost first)
+PARAMS = ("gamma", "tile", "clip_cons", "clip_agg", "alpha", "beta", "delta")
+
+
+def _nbytes(v):
+    if isinstance(v, np.ndarray):
+        return v.nbytes
+    if isinstance(v, (tuple, list)):
+        return sum(_nbytes(x) for x in v)
+    return 0
+
+
+class LRUCache(MutableMapping):
+    """
+    Least-recently-used mapping bounded by the total bytes of its arrays.
+
+    Parameters
+    ----------
+    max_bytes : int
+        Budget for the stored values (numpy arrays, or tuples of them).
+        The most recent entry is always kept, even if it alone exceeds it.
+    """
+
+    def __init__(self, max_bytes=512 * 2**20):
+        self.max_bytes = int(max_bytes)
+        self.nbytes = 0
+        self.evictions = 0
+        self._d = OrderedDict()
+
+    def __getitem__(self, k):
+        v = self._d[k][0]
+        self._d.move_to_end(k)
+        return v
+
+    def __setitem__(self, k, v):
+        if k in self._d:
+            self.nbytes -= self._d[k][1]
+        size = _nbytes(v)
+        self._d[k] = (v, size)
+        self._d.move_to_end(k)
+        self.nbytes += size
+        while self.nbytes > self.max_bytes and len(self._d) > 1:
+            _, (_, s) = self._d.popitem(last=False)
+            self.nbytes -= s
+            self.evictions += 1
+
+    def __delitem__(self, k):
+        self.nbytes -= self._d.pop(k)[1]
+
+    def __contains__(self, k):
+        return k in self._d
+
+    def __iter__(self):
+        return iter(self._d)
+
+    def __len__(self):
+        return len(self._d)
+
+
+def grid(**axes):
+    """
+    All combinations of the given parameter values, as a list of dicts.
+
+    Axes are ordered as in ``PARAMS`` (gamma first) regardless of the
+    keyword order. Each axis is a list of values; anything else (a float,
+    or a ``tile`` tuple) is a one-value axis.
+    """
+    unknown = set(axes) - set(PARAMS)
+    if unknown:
+        raise ValueError(f"unknown sweep parameter(s): {', '.join(sorted(unknown))}")
+    keys = [k for k in PARAMS if k in axes]
+    vals = [axes[k] if isinstance(axes[k], list) else [axes[k]] for k in keys]
+    return [dict(zip(keys, combo)) for combo in product(*vals)]
+
+
+def sweep(img01, points, ref01=None, cache=None, keep=False, **fixed):
+    """
+    Run ``nw_gc_clahe`` at every grid point, reusing shared stages.
+
+    Parameters
+    ----------
+    img01 : np.ndarray
+        Input image in [0,1] (e.g. the degraded slice).
+    points : list of dict
+        Parameter settings, usually from ``grid``.
+    ref01 : np.ndarray, optional
+        Reference for scoring; if given each point gets UIQI/SSIM/FSIM.
+    cache : MutableMapping, optional
+        Stage cache; defaults to ``LRUCache()``. Pass the same cache to
+        several calls only if they share ``img01``.
+    keep : bool
+        Also return the enhanced image of every point.
+    **fixed
+        Parameters held constant for all points (e.g. ``bins``).
+
+    Returns
+    -------
+    results : list of dict
+        One per point: the parameters, the scores if ``ref01`` was given
+        and ``"out"`` if ``keep``.
+    ex : Executor
+        The executor used; ``ex.computed`` lists every stage evaluation.
+    """
+    cache = LRUCache() if cache is None else cache
+    x = source()
+    ex = Executor({x: img01}, cache=cache)
+    engine = MetricsEngine(ref01) if ref01 is not None else None
+    results = []
+    for p in points:
+        target = nw_gc_clahe_method(x, **{**fixed, **p})
+        out = ex[target]
+        # final blends are never shared between points; don't let them
+        # push reusable stages out of the cache
+        cache.pop(target, None)
+        row = dict(p)
+        if engine is not None:
+            img = np.clip(out.astype(np.float32), 0.0, 1.0)
+            row.update(zip(MetricsEngine.names, engine.score(img)))
+        if keep:
+            row["out"] = out
+        results.append(row)
+    return results, ex
+
+
+def stage_counts(ex):
+    """``{stage: evaluations}`` for an executor, e.g. to count CLAHE passes."""
+    counts = {}
+    for n in ex.computed:
+        counts[n.stage] = counts.get(n.stage, 0) + 1
+    return counts
@@ -0,0 +1,201 @@
+"""
+Block-wise nw_gc_clahe for images too large for the in-memory path.
+
+``nw_gc_clahe`` holds about ten full-size float arrays at once. Here the
+image is cut into blocks that are aligned to the CLAHE tile grid, each
+read with a halo wide enough for the 3x3 Sobel and the 7x7 box filters of
+``noise_map``, and processed on its own. The steps that need the whole
+image are done in cheap passes over the blocks first:
+
+1. min / max of the gamma-corrected image (``ngc`` normalisation);
+2. min / max of the Sobel magnitude (``edge_map``) and the CLAHE tile
+   histograms of the whole image, from which the LUTs are built once;
+3. min / max of the edge-weighted local variance (``noise_map``).
+
+The last pass writes each block of the output. An image that fits the
+budget as a single block goes straight to ``nw_gc_clahe``. Border pixels get their
+halo from the same reflections the whole-image filters use (scipy's
+``reflect``, and OpenCV's ``BORDER_REFLECT_101`` for the CLAHE padding),
+so the result matches ``nw_gc_clahe`` to float32 rounding; CLAHE is
+identical.
+
+Peak memory is the blocks' temporaries, sized to ``budget_mb``, plus the
+output (pass a ``np.memmap`` as ``out`` to keep that on disk too). The
+input can be a memory-mapped array, e.g. ``np.load(path, mmap_mode="r")``.
+The filters run in passes 2-4, so the compute is about 2.5x that of
+``nw_gc_clahe``.
+"""
+import numpy as np
+from scipy.ndimage import uniform_filter
+from skimage.filters import sobel
+
+from src.utils.trace import traced
+from .clahe_multi import (
+    _grid, quantize01, tile_pixels, tile_histograms, clip_luts, interpolate_luts,
+)
+from .nw_gc_clahe import nw_gc_clahe, weight_map, blend
+
+NOISE_K = 7
+HALO = NOISE_K // 2      # covers the Sobel's 1 px too
+# peak temporaries of one output block per (haloed) pixel, float32 input
+BYTES_PER_PX = 96
+
+
+def block_shape(shape, tile=(8, 8), budget_mb=256):
+    """
+    (rows, cols) of the blocks for an image of ``shape``: full-width
+    strips when a strip of one tile row fits the budget, else tile-aligned
+    squares; never smaller than one CLAHE tile.
+    """
+    (ph, pw), (sy, sx) = _grid(shape, tile)
+    px = max(budget_mb, 1) * 2**20 / BYTES_PER_PX
+    if (sy + 2 * HALO) * (pw + 2 * HALO) <= px:
+        rows = int(px // (pw + 2 * HALO)) - 2 * HALO
+        return min(max(rows // sy, 1) * sy, ph), pw
+    side = int(np.sqrt(px)) - 2 * HALO
+    return max(side // sy, 1) * sy, max(side // sx, 1) * sx
+
+
+def _index(start, stop, n, mode):
+    i = np.arange(start, stop)
+    if mode == "reflect":   # scipy: d c b a | a b c d
+        i = np.where(i < 0, -i - 1, i)
+        return np.where(i >= n, 2 * n - i - 1, i)
+    # OpenCV BORDER_REFLECT_101 / np.pad "reflect": d c b | a b c d
+    i = np.abs(i)
+    return np.where(i >= n, 2 * n - i - 2, i)
+
+
+def _read(img, r0, r1, c0, c1, mode="reflect"):
+    """``img[r0:r1, c0:c1]``, reflected where the range leaves the image."""
+    h, w = img.shape
+    if r0 >= 0 and c0 >= 0 and r1 <= h and c1 <= w:
+        return np.asarray(img[r0:r1, c0:c1])
+    rows = _index(r0, r1, h, mode)
+    cols = _index(c0, c1, w, mode)
+    r = slice(rows.min(), rows.max() + 1)
+    c = slice(cols.min(), cols.max() + 1)
+    return np.asarray(img[r, c])[rows - r.start][:, cols - c.start]
+
+
+def _blocks(shape, bshape):
+    h, w = shape
+    for r0 in range(0, h, bshape[0]):
+        for c0 in range(0, w, bshape[1]):
+            yield r0, min(r0 + bshape[0], h), c0, min(c0 + bshape[1], w)
+
+
+def _ngc(block, gmin, gmax, gamma):
+    # ngc() with the whole image's min / max
+    g = np.clip(block, 0, 1) ** float(gamma)
+    return (g - gmin) / (gmax - gmin + 1e-8)
+
+
+class _Range:
+    """Running min / max, kept in the dtype of the arrays seen."""
+
+    def __init__(self):
+        self.lo = self.hi = None
+
+    def add(self, a):
+        lo, hi = a.min(), a.max()
+        self.lo = lo if self.lo is None else min(self.lo, lo)
+        self.hi = hi if self.hi is None else max(self.hi, hi)
+
+
+def _maps(x, p, E_range, z_range=None):
+    """
+    (E, z or N) on the interior of a block read with ``HALO`` pixels of
+    context; N is normalised once ``z_range`` is known.
+    """
+    e = np.abs(sobel(x))[p:-p, p:-p]
+    E = (e - E_range.lo) / (E_range.hi - E_range.lo + 1e-8)
+    m = uniform_filter(x, size=NOISE_K)[p:-p, p:-p]
+    m2 = uniform_filter(x * x, size=NOISE_K)[p:-p, p:-p]
+    z = np.maximum(m2 - m * m, 0.0) * (1.0 - E)
+    if z_range is None:
+        return E, z
+    return E, (z - z_range.lo) / (z_range.hi - z_range.lo + 1e-8)
+
+
+@traced()
+def nw_gc_clahe_tiled(img01, gamma=0.95,
+                      clip_cons=1.0, clip_agg=3.0, tile=(8, 8),
+                      alpha=0.8, beta=0.6, delta=0.2, bins=256,
+                      budget_mb=256, out=None):
+    """
+    ``nw_gc_clahe(img01, ...)[0]`` computed block by block.
+
+    Parameters
+    ----------
+    img01 : np.ndarray
+        2D image in [0,1]; may be memory-mapped.
+    budget_mb : float
+        Memory for the per-block temporaries (see ``block_shape``).
+    out : np.ndarray, optional
+        float32 array of the image's shape to write into, e.g. a
+        ``np.memmap``; allocated if not given.
+
+    Returns
+    -------
+    np.ndarray
+        The enhanced image (``out``).
+    """
+    shape = img01.shape
+    h, w = shape
+    bshape = block_shape(shape, tile, budget_mb)
+    (ph, pw), (sy, sx) = _grid(shape, tile)
+    if bshape[0] >= h and bshape[1] >= w:
+        # one block: the in-memory path fits the budget and is the same
+        res = nw_gc_clahe(np.asarray(img01), gamma=gamma, clip_cons=clip_cons,
+                          clip_agg=clip_agg, tile=tile, alpha=alpha, beta=beta,
+                          delta=delta, bins=bins)[0]
+        if out is None:
+            return res
+        out[...] = res
+        return out
+    tiles = (tile[1], tile[0])
+    p = HALO
+
+    # 1. ngc normalisation
+    g_range = _Range()
+    for r0, r1, c0, c1 in _blocks(shape, bshape):
+        g_range.add(np.clip(np.asarray(img01[r0:r1, c0:c1]), 0, 1) ** float(gamma))
+    ngc01 = lambda b: _ngc(b, g_range.lo, g_range.hi, gamma)
+
+    # 2. edge normalisation and CLAHE histograms (over cv2's padded grid)
+    e_range = _Range()
+    hist = np.zeros(tiles + (bins,), dtype=np.int64)
+    for r0, r1, c0, c1 in _blocks(shape, bshape):
+        x = ngc01(_read(img01, r0 - 1, r1 + 1, c0 - 1, c1 + 1))
+        e_range.add(np.abs(sobel(x))[1:-1, 1:-1])
+        R1 = ph if r1 == h else r1
+        C1 = pw if c1 == w else c1
+        if (R1, C1) == (r1, c1):
+            x = x[1:-1, 1:-1]
+        else:
+            x = ngc01(_read(img01, r0, R1, c0, C1, mode="reflect101"))
+        q = quantize01(x, bins=bins)
+        grid = ((C1 - c0) // sx, (R1 - r0) // sy)
+        hist[r0 // sy:R1 // sy, c0 // sx:C1 // sx] = tile_histograms(q, grid, bins)
+    luts = clip_luts(hist, (clip_cons, clip_agg), tile_pixels(shape, tile), bins=bins)
+
+    # 3. noise normalisation
+    z_range = _Range()
+    for r0, r1, c0, c1 in _blocks(shape, bshape):
+        x = ngc01(_read(img01, r0 - p, r1 + p, c0 - p, c1 + p))
+        z_range.add(_maps(x, p, e_range)[1])
+
+    # 4. output
+    if out is None:
+        out = np.empty(shape, dtype=np.float32)
+    for r0, r1, c0, c1 in _blocks(shape, bshape):
+        x = ngc01(_read(img01, r0 - p, r1 + p, c0 - p, c1 + p))
+        E, N = _maps(x, p, e_range, z_range)
+        q = quantize01(x[p:-p, p:-p], bins=bins)
+        cons, agg = interpolate_luts(q, luts, origin=(r0, c0), shape=shape)
+        cons /= float(bins - 1)
+        agg /= float(bins - 1)
+        W = weight_map(E, N, alpha=alpha, beta=beta, delta=delta)
+        out[r0:r1, c0:c1] = blend(W, agg, cons)
+    return out
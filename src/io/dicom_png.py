@@ -1,37 +1,160 @@
 import numpy as np
+import cv2
 import imageio.v2 as iio
 import pydicom
+from functools import lru_cache
 from pathlib import Path
 
-def read_dicom_hu(path):
+from src.utils.percentile import percentiles
+from src.utils.trace import traced
+
+# CT window presets (WL, WW)
+WINDOWS = {
+    "soft": (40, 400),          # brain / soft tissue
+    "lung": (-600, 1500),
+    "bone": (400, 1800),
+    "subdural": (50, 130),
+}
+
+def parse_windows(spec):
+    # "soft", "soft,lung" or "all" -> list of preset names
+    names = list(WINDOWS) if spec == "all" else [m.strip() for m in spec.split(",") if m.strip()]
+    unknown = [m for m in names if m not in WINDOWS]
+    if unknown or not names:
+        raise ValueError(f"unknown window preset(s) {unknown}; choose from {', '.join(WINDOWS)} or 'all'")
+    return names
+
+@traced()
+def read_dicom_raw(path):
+    # stored integer pixels plus rescale, without converting to HU
     ds = pydicom.dcmread(str(path))
+    slope = float(getattr(ds, "RescaleSlope", 1.0))
+    inter = float(getattr(ds, "RescaleIntercept", 0.0))
+    return ds.pixel_array, slope, inter
+
+@traced()
+def read_dicom_hu(path):
+    # path, or a binary file object such as io.BytesIO(dicom_bytes)
+    ds = pydicom.dcmread(path if hasattr(path, "read") else str(path))
     arr = ds.pixel_array.astype(np.float32)
     slope = float(getattr(ds, "RescaleSlope", 1.0))
     inter = float(getattr(ds, "RescaleIntercept", 0.0))
     hu = slope * arr + inter
     return hu
 
-def read_gray01(path):
-    # For PNG/JPG: return [0,1]
-    img = iio.imread(str(path))
-    if img.ndim == 3:
-        img = img[...,0]
+@traced()
+def read_gray(path):
+    # For PNG/JPG/TIFF: native-dtype grey image and its bit depth, e.g.
+    # (uint8, 8) or (uint16, 16); bits is None for float/signed images.
+    # Colour images keep the red channel, as read_gray01 always did.
+    img = cv2.imread(str(path), cv2.IMREAD_UNCHANGED)
+    if img is None:
+        # formats OpenCV cannot decode
+        img = iio.imread(str(path))
+        if img.ndim == 3:
+            img = img[..., 0]
+    elif img.ndim == 3:
+        img = cv2.extractChannel(img, 2)  # OpenCV decodes to BGR(A)
+    bits = img.dtype.itemsize * 8 if img.dtype.kind == "u" else None
+    return np.ascontiguousarray(img), bits
+
+@lru_cache(maxsize=None)
+def level_lut(bits):
+    # float32 [0,1] value of every level: level / (2**bits - 1)
+    top = (1 << bits) - 1
+    lut = np.arange(top + 1, dtype=np.float32) / np.float32(top)
+    lut.flags.writeable = False
+    return lut
+
+def gray01(img, bits):
+    # Native grey image -> float32 [0,1] by its bit depth; an image whose
+    # max is <= 1 (binary masks) is left unscaled, as before
+    if bits and img.max() > 1:
+        return level_lut(bits).take(img)
     img = img.astype(np.float32)
     if img.max() > 1.0: img /= 255.0
     return np.clip(img, 0, 1)
 
+def read_gray01(path):
+    # For PNG/JPG: return [0,1]
+    return gray01(*read_gray(path))
+
 def is_dicom(path: Path):
     return path.suffix.lower() == ".dcm"
 
+@traced()
 def window_hu(hu, wl, ww):
     lo, hi = wl - ww/2.0, wl + ww/2.0
     x = np.clip(hu, lo, hi)
     return (x - lo) / (hi - lo + 1e-8)
 
+def window_lut(vmin, vmax, slope, inter, wl, ww):
+    # Windowing evaluated once per possible stored value instead of per
+    # pixel; lut[raw - vmin] is bit-identical to window_hu(slope*raw+inter).
+    vals = np.arange(vmin, vmax + 1).astype(np.float32)
+    return window_hu(slope * vals + inter, wl, ww).astype(np.float32)
+
+@traced()
+def window_raw_multi(raw, slope, inter, names):
+    # one decoded slice -> {preset: windowed [0,1] image}
+    vmin, vmax = int(raw.min()), int(raw.max())
+    idx = raw.astype(np.intp)
+    if vmin:
+        idx -= vmin
+    return {name: window_lut(vmin, vmax, slope, inter, *WINDOWS[name]).take(idx)
+            for name in names}
+
+@traced()
+def window_hu_levels(hu, wl, ww, bits=12):
+    # Same window as window_hu, but as uint16 levels 0..2**bits-1 so
+    # high-bit-depth CLAHE can work on integers without a [0,1] float image
+    top = (1 << bits) - 1
+    lo, hi = wl - ww/2.0, wl + ww/2.0
+    x = np.clip(hu, lo, hi) - lo
+    x *= top / (hi - lo + 1e-8)
+    return np.rint(x).astype(np.uint16)
+
+@traced()
 def window_img01(img01, p_lo=2, p_hi=98):
     # If you only have PNGs and no HU, emulate a window by percentiles
-    lo = np.percentile(img01, p_lo)
-    hi = np.percentile(img01, p_hi)
+    # (both from one histogram pass; same values as np.percentile)
+    lo, hi = percentiles(img01, (p_lo, p_hi))
     x = np.clip(img01, lo, hi)
     return (x - lo) / (hi - lo + 1e-8)
 
+@traced()
+def window_gray01(img, bits, p_lo=2, p_hi=98):
+    # window_img01(gray01(img, bits)) with the percentiles taken on the
+    # integer levels and the stretch applied as one LUT lookup
+    if not bits or img.max() <= 1:
+        return window_img01(gray01(img, bits), p_lo, p_hi)
+    lut = level_lut(bits)
+    lo, hi = percentiles(img, (p_lo, p_hi), levels=lut)
+    x = np.clip(lut, lo, hi)
+    return ((x - lo) / (hi - lo + 1e-8)).take(img)
+
+
+def read_windowed01(path, wl, ww):
+    """Load a DICOM (HU window) or PNG/JPG (percentile window) as [0,1]."""
+    path = Path(path)
+    if is_dicom(path):
+        x = window_hu(read_dicom_hu(path), wl, ww)
+    else:
+        x = window_gray01(*read_gray(path))
+    return np.clip(x.astype(np.float32), 0.0, 1.0)
+
+
+def read_windowed01_multi(path, names):
+    """
+    Load one slice and window it with every preset in ``names``.
+
+    DICOM is decoded once and each window is applied as an integer-HU LUT;
+    PNG/JPG has no HU, so all presets share one percentile window.
+    """
+    path = Path(path)
+    if is_dicom(path):
+        raw, slope, inter = read_dicom_raw(path)
+        wins = window_raw_multi(raw, slope, inter, names)
+        return {n: np.clip(x, 0.0, 1.0) for n, x in wins.items()}
+    x = np.clip(window_gray01(*read_gray(path)).astype(np.float32), 0.0, 1.0)
+    return {n: x for n in names}
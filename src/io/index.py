@@ -0,0 +1,237 @@
+"""
+Persistent index of the slices under a data folder.
+
+``DatasetIndex`` walks a folder recursively and keeps one SQLite row per
+DICOM / image / .npy file: size and mtime, plus what can be learned without
+decoding pixels (DICOM headers are read with ``stop_before_pixels``; PNG and
+.npy shapes come from their headers). On the next ``update`` only files
+whose size or mtime changed are read again, and deleted files are dropped,
+so listing a large archive costs one directory walk instead of one decode
+per file.
+"""
+import hashlib
+import os
+import sqlite3
+from collections import namedtuple
+from pathlib import Path
+
+import numpy as np
+import pydicom
+from PIL import Image
+
+DB_NAME = ".dsindex.sqlite"
+# where indexes of read-only folders go (next to the result cache's default)
+FALLBACK_DIR = Path("data/cache/index")
+KINDS = {".dcm": "dicom", ".npy": "npy",
+         ".png": "image", ".jpg": "image", ".jpeg": "image",
+         ".tif": "image", ".tiff": "image", ".bmp": "image"}
+
+_COLS = ("path", "mtime_ns", "size", "kind", "stem", "sop_uid", "series_uid",
+         "position", "instance", "slope", "intercept", "rows", "cols", "error")
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER, kind TEXT,
+    stem TEXT, sop_uid TEXT, series_uid TEXT, position REAL, instance INTEGER,
+    slope REAL, intercept REAL, rows INTEGER, cols INTEGER, error TEXT
+);
+CREATE INDEX IF NOT EXISTS files_stem ON files (stem);
+CREATE INDEX IF NOT EXISTS files_series ON files (series_uid, position);
+"""
+_ORDER = ("ORDER BY COALESCE(series_uid, ''), position IS NULL, position, "
+          "instance, path")
+
+# one indexed file; ``path`` is absolute, header fields are None if unknown
+Entry = namedtuple("Entry", _COLS)
+
+
+def _position(ds):
+    # distance along the slice normal, falling back to SliceLocation
+    ipp = getattr(ds, "ImagePositionPatient", None)
+    iop = getattr(ds, "ImageOrientationPatient", None)
+    if ipp is not None and iop is not None and len(iop) == 6:
+        normal = np.cross(np.asarray(iop[:3], float), np.asarray(iop[3:], float))
+        return float(np.dot(normal, np.asarray(ipp, float)))
+    if ipp is not None:
+        return float(ipp[2])
+    loc = getattr(ds, "SliceLocation", None)
+    return float(loc) if loc is not None else None
+
+
+def read_header(path, kind):
+    """Header fields of one file as a dict of ``Entry`` columns."""
+    info = {}
+    if kind == "dicom":
+        ds = pydicom.dcmread(str(path), stop_before_pixels=True)
+        inst = getattr(ds, "InstanceNumber", None)
+        info.update(
+            sop_uid=str(getattr(ds, "SOPInstanceUID", "")) or None,
+            series_uid=str(getattr(ds, "SeriesInstanceUID", "")) or None,
+            position=_position(ds),
+            instance=int(inst) if inst is not None else None,
+            slope=float(getattr(ds, "RescaleSlope", 1.0)),
+            intercept=float(getattr(ds, "RescaleIntercept", 0.0)),
+            rows=int(ds.Rows), cols=int(ds.Columns),
+        )
+    elif kind == "image":
+        with Image.open(path) as im:
+            info.update(cols=im.size[0], rows=im.size[1])
+    else:
+        shape = np.load(path, mmap_mode="r").shape
+        info.update(rows=shape[-2], cols=shape[-1])
+    return info
+
+
+def _walk(root):
+    stack = [root]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for e in it:
+                if e.name.startswith("."):
+                    continue
+                if e.is_dir(follow_symlinks=False):
+                    stack.append(e.path)
+                elif Path(e.name).suffix.lower() in KINDS:
+                    yield e
+
+
+def index_path(root, db=None):
+    """
+    Index file for ``root``: ``db`` if given, else ``root/.dsindex.sqlite``,
+    or, when that cannot be written, one file per folder under
+    ``FALLBACK_DIR``.
+    """
+    if db:
+        return Path(db)
+    root = Path(root).resolve()
+    own = root / DB_NAME
+    if os.access(own if own.exists() else root, os.W_OK):
+        return own
+    tag = hashlib.sha1(str(root).encode()).hexdigest()[:12]
+    FALLBACK_DIR.mkdir(parents=True, exist_ok=True)
+    return FALLBACK_DIR / f"{root.name}-{tag}.sqlite"
+
+
+class DatasetIndex:
+    """
+    SQLite-backed index of a data folder.
+
+    Parameters
+    ----------
+    root : str or Path
+        Folder to index (walked recursively; dot-files and dot-dirs are
+        skipped).
+    db : str or Path, optional
+        Index file. Defaults to ``root/.dsindex.sqlite``, or a file under
+        ``FALLBACK_DIR`` for a read-only folder (``index_path``).
+    """
+
+    def __init__(self, root, db=None):
+        self.root = Path(root).resolve()
+        self.db = index_path(self.root, db)
+        self.con = sqlite3.connect(str(self.db))
+        self.con.executescript(_SCHEMA)
+
+    def close(self):
+        self.con.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def update(self):
+        """
+        Bring the index in line with the folder.
+
+        Returns
+        -------
+        (changed, removed, unchanged) : tuple of int
+        """
+        known = {p: (m, s) for p, m, s in
+                 self.con.execute("SELECT path, mtime_ns, size FROM files")}
+        rows, seen = [], set()
+        for e in _walk(self.root):
+            rel = Path(e.path).relative_to(self.root).as_posix()
+            seen.add(rel)
+            st = e.stat()
+            if known.get(rel) == (st.st_mtime_ns, st.st_size):
+                continue
+            kind = KINDS[Path(e.name).suffix.lower()]
+            row = dict.fromkeys(_COLS)
+            row.update(path=rel, mtime_ns=st.st_mtime_ns, size=st.st_size,
+                       kind=kind, stem=Path(e.name).stem)
+            try:
+                row.update(read_header(e.path, kind))
+            except Exception as ex:
+                # remembered, so a broken file is not re-read every run
+                row["error"] = f"{type(ex).__name__}: {ex}"
+            rows.append(tuple(row[c] for c in _COLS))
+        gone = [(p,) for p in known if p not in seen]
+        with self.con:
+            self.con.executemany(
+                f"INSERT OR REPLACE INTO files VALUES ({','.join('?' * len(_COLS))})", rows)
+            self.con.executemany("DELETE FROM files WHERE path = ?", gone)
+        return len(rows), len(gone), len(seen) - len(rows)
+
+    def _entries(self, where="", args=()):
+        q = f"SELECT {','.join(_COLS)} FROM files {where} {_ORDER}"
+        return [Entry(self.root / r[0], *r[1:]) for r in self.con.execute(q, args)]
+
+    def entries(self, kind=None):
+        """All entries, ordered by series, slice position, then path."""
+        if kind is None:
+            return self._entries()
+        return self._entries("WHERE kind = ?", (kind,))
+
+    def paths(self, kind=None):
+        return [e.path for e in self.entries(kind)]
+
+    def series(self):
+        """``{SeriesInstanceUID: [Entry...]}`` for readable DICOM, in slice order."""
+        out = {}
+        for e in self._entries("WHERE kind = 'dicom' AND error IS NULL"):
+            out.setdefault(e.series_uid, []).append(e)
+        return out
+
+
+def add_index_arg(ap):
+    ap.add_argument(
+        "--index",
+        action="store_true",
+        help="list inputs through a cached header index (recursive, "
+             "ordered by series and slice position)",
+    )
+    ap.add_argument(
+        "--index-db",
+        default=None,
+        help="index file for --index (default SRC/.dsindex.sqlite, or one "
+             f"under {FALLBACK_DIR} if SRC is read-only)",
+    )
+
+
+def list_inputs(folder, use_index=False, db=None):
+    """Input files of a CLI: sorted top-level files, or the indexed listing."""
+    folder = Path(folder)
+    if not use_index:
+        return [p for p in sorted(folder.iterdir())
+                if not p.is_dir() and p.name != DB_NAME]
+    with DatasetIndex(folder, db=db) as idx:
+        idx.update()
+        return idx.paths()
+
+
+def list_series(folder, use_index=False, db=None):
+    """
+    Inputs grouped into series, each in slice order: one group per
+    SeriesInstanceUID (plus one for files without one) with the index,
+    else the sorted top-level files as a single series.
+    """
+    if not use_index:
+        return [list_inputs(folder)]
+    with DatasetIndex(folder, db=db) as idx:
+        idx.update()
+        groups = {}
+        for e in idx.entries():
+            groups.setdefault(e.series_uid, []).append(e.path)
+    return list(groups.values())
@@ -0,0 +1,92 @@
+"""
+Overlap slice I/O with compute.
+
+``prefetch`` runs a loader in a small thread pool, keeping at most
+``depth`` slices decoded ahead of the consumer, and yields them in input
+order. ``BackgroundWriter`` is the output side: ``save`` queues an
+``np.save`` on a writer thread and only blocks once ``depth`` writes are
+pending. pydicom / imageio decode and file writes spend much of their time
+outside the GIL (file reads, zlib, numpy copies), so a serial run keeps the
+CPU on the enhancement while the next slice is read and the previous one
+written. Memory is capped at roughly ``depth`` slices either way.
+"""
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+_END = object()
+
+
+def prefetch(items, load, depth=4, threads=2):
+    """
+    Yield ``(item, load(item), error)`` in order, loading ahead in threads.
+
+    ``error`` is ``"ExcType: message"`` if ``load`` raised (value is then
+    None), matching ``map_slices``.
+    """
+    items = iter(items)
+    pending = deque()
+    with ThreadPoolExecutor(max(1, threads)) as pool:
+        def fill():
+            while len(pending) < max(1, depth):
+                it = next(items, _END)
+                if it is _END:
+                    return
+                pending.append((it, pool.submit(load, it)))
+
+        fill()
+        while pending:
+            it, fut = pending.popleft()
+            fill()
+            try:
+                value, err = fut.result(), None
+            except Exception as e:
+                value, err = None, f"{type(e).__name__}: {e}"
+            yield it, value, err
+
+
+class BackgroundWriter:
+    """
+    Run writes on worker threads with a bounded backlog.
+
+    Parameters
+    ----------
+    threads : int
+        Writer threads.
+    depth : int
+        Pending writes allowed before ``submit`` blocks.
+
+    The first write error is raised from ``close`` (or on leaving a
+    ``with`` block).
+    """
+
+    def __init__(self, threads=1, depth=8):
+        self._pool = ThreadPoolExecutor(max(1, threads))
+        self._slots = threading.BoundedSemaphore(max(1, depth))
+        self._errors = []
+
+    def _done(self, fut):
+        self._slots.release()
+        if fut.exception() is not None:
+            self._errors.append(fut.exception())
+
+    def submit(self, fn, *args, **kwargs):
+        self._slots.acquire()
+        self._pool.submit(fn, *args, **kwargs).add_done_callback(self._done)
+
+    def save(self, path, arr):
+        """Queue ``np.save(path, arr)``; ``arr`` must not be modified afterwards."""
+        self.submit(np.save, path, arr)
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+        if self._errors:
+            raise self._errors[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
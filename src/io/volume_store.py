@@ -0,0 +1,274 @@
+"""
+Chunked slice store: one directory per series / method instead of one
+.npy per slice.
+
+A store is a folder ``<name>.vol/`` holding ``meta.json`` (slice shape,
+dtype, chunk size, slice stems) and the slices stacked ``chunk`` at a time
+into ``c00000.npy``, ``c00001.npy``, ... Uncompressed chunks are opened
+with ``mmap_mode="r"``, so reading a slice is a view into the page cache
+rather than an open + parse + full load of its own file. With
+``compress=True`` chunks are written as zlib ``.npz`` (lossless) and
+decoded one chunk at a time on access.
+
+``meta.json`` lists only slices whose chunk is on disk. It is rewritten
+(atomically) after every chunk and on ``close``, so a store whose writer
+died still opens, with every slice up to its last complete chunk.
+
+A store holds one series of equally sized slices. ``SeriesWriter`` keeps
+one store per series of a run: ``<name>.vol``, ``<name>-1.vol``, ...
+(``list_stores`` finds them again).
+"""
+import json
+import os
+import re
+import shutil
+from collections import namedtuple
+from pathlib import Path
+
+import numpy as np
+
+META = "meta.json"
+EXT = ".vol"
+
+
+def is_store(path):
+    return (Path(path) / META).is_file()
+
+
+class VolumeWriter:
+    """
+    Append slices to a new store.
+
+    Parameters
+    ----------
+    path : str or Path
+        Store folder; replaced if it already exists.
+    chunk : int
+        Slices per chunk file.
+    compress : bool
+        Write zlib-compressed ``.npz`` chunks instead of mmap-able ``.npy``.
+    dtype : numpy dtype, optional
+        Stored dtype; defaults to that of the first slice.
+    """
+
+    def __init__(self, path, chunk=64, compress=False, dtype=None):
+        self.path = Path(path)
+        if self.path.exists():
+            shutil.rmtree(self.path)
+        self.path.mkdir(parents=True)
+        self.chunk = int(chunk)
+        self.compress = bool(compress)
+        self.dtype = None if dtype is None else np.dtype(dtype)
+        self.shape = None
+        self.stems = []
+        self._buf = []
+        self._n = 0
+
+    def append(self, stem, img):
+        img = np.asarray(img)
+        if self.shape is None:
+            self.shape = img.shape
+            self.dtype = self.dtype or img.dtype
+        elif img.shape != self.shape:
+            raise ValueError(f"slice {stem} has shape {img.shape}, store has {self.shape}")
+        self._buf.append(img.astype(self.dtype, copy=False))
+        self.stems.append(str(stem))
+        if len(self._buf) == self.chunk:
+            self._flush()
+
+    def _flush(self):
+        if not self._buf:
+            return
+        block = np.stack(self._buf)
+        name = self.path / f"c{self._n:05d}"
+        if self.compress:
+            np.savez_compressed(name.with_suffix(".npz"), a=block)
+        else:
+            np.save(name.with_suffix(".npy"), block)
+        self._buf = []
+        self._n += 1
+        self._write_meta()
+
+    def _write_meta(self):
+        meta = {
+            "shape": list(self.shape or ()),
+            "dtype": str(self.dtype) if self.dtype else None,
+            "chunk": self.chunk,
+            "compress": self.compress,
+            # slices still in the buffer are not on disk yet
+            "stems": self.stems[:len(self.stems) - len(self._buf)],
+        }
+        tmp = self.path / (META + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp, self.path / META)
+
+    def close(self):
+        self._flush()
+        self._write_meta()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def store_name(name, series=0):
+    """Folder of ``name``'s store for the ``series``-th series of a run."""
+    return f"{name}{EXT}" if series == 0 else f"{name}-{series}{EXT}"
+
+
+def list_stores(folder, name):
+    """``name``'s stores in ``folder``, in series order."""
+    pat = re.compile(rf"{re.escape(name)}(?:-(\d+))?{re.escape(EXT)}")
+    found = []
+    for p in Path(folder).glob(f"{name}*{EXT}"):
+        m = pat.fullmatch(p.name)
+        if m and is_store(p):
+            found.append((int(m.group(1) or 0), p))
+    return [p for _, p in sorted(found)]
+
+
+class SeriesWriter:
+    """
+    ``name``'s stores in ``folder``, one per series.
+
+    Slices are routed by ``series`` (any hashable label, e.g. the
+    SeriesInstanceUID) and shape: the first slice of a new label, or of a
+    shape its series has not had so far, opens the next store
+    (``store_name``). Stores of ``name`` left in ``folder`` by an earlier
+    run are removed first.
+    """
+
+    def __init__(self, folder, name, chunk=64, compress=False):
+        self.folder = Path(folder)
+        self.name = name
+        self.kw = {"chunk": chunk, "compress": compress}
+        self.writers = {}
+        pat = re.compile(rf"{re.escape(name)}(?:-\d+)?{re.escape(EXT)}")
+        for p in self.folder.glob(f"{name}*{EXT}"):
+            if pat.fullmatch(p.name) and p.is_dir():
+                shutil.rmtree(p)
+
+    def append(self, stem, img, series=None):
+        img = np.asarray(img)
+        key = (series, img.shape)
+        w = self.writers.get(key)
+        if w is None:
+            w = self.writers[key] = VolumeWriter(
+                self.folder / store_name(self.name, len(self.writers)), **self.kw)
+        w.append(stem, img)
+
+    def close(self):
+        for w in self.writers.values():
+            w.close()
+
+
+class VolumeStore:
+    """
+    Read-only access to a store, by slice index or by stem.
+
+    ``store[i]`` / ``store["stem"]`` return a read-only view into the
+    memory-mapped chunk (or into the decoded chunk if compressed);
+    ``store.read(i0, i1)`` returns a contiguous (n, H, W) copy.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path / META) as f:
+            meta = json.load(f)
+        self.shape = tuple(meta["shape"])
+        self.dtype = np.dtype(meta["dtype"]) if meta["dtype"] else None
+        self.chunk = meta["chunk"]
+        self.compress = meta["compress"]
+        self.stems = meta["stems"]
+        self._pos = {s: i for i, s in enumerate(self.stems)}
+        self._chunks = {}
+
+    def __len__(self):
+        return len(self.stems)
+
+    def __contains__(self, stem):
+        return stem in self._pos
+
+    def index(self, stem):
+        return self._pos[stem]
+
+    def _chunk(self, c):
+        a = self._chunks.get(c)
+        if a is None:
+            name = self.path / f"c{c:05d}"
+            if self.compress:
+                # keep only the last decoded chunk; sequential reads hit it
+                self._chunks.clear()
+                with np.load(name.with_suffix(".npz")) as z:
+                    a = z["a"]
+                a.flags.writeable = False
+            else:
+                a = np.load(name.with_suffix(".npy"), mmap_mode="r")
+            self._chunks[c] = a
+        return a
+
+    def __getitem__(self, key):
+        i = self._pos[key] if isinstance(key, str) else int(key)
+        if not -len(self) <= i < len(self):
+            raise IndexError(f"slice {i} out of range for {len(self)} slices")
+        i %= len(self)
+        return self._chunk(i // self.chunk)[i % self.chunk]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def read(self, start=0, stop=None):
+        stop = len(self) if stop is None else min(stop, len(self))
+        out = np.empty((max(stop - start, 0),) + self.shape, dtype=self.dtype)
+        for i in range(start, stop):
+            out[i - start] = self[i]
+        return out
+
+    def refs(self):
+        return [SliceRef(str(self.path), i, s) for i, s in enumerate(self.stems)]
+
+
+class SliceRef(namedtuple("SliceRef", ["store", "index", "stem"])):
+    """Picklable handle to one stored slice, usable as a work item."""
+
+    @property
+    def name(self):
+        return f"{Path(self.store).name}[{self.stem}]"
+
+    def load(self):
+        return open_store(self.store)[self.index]
+
+
+_OPEN = {}
+
+
+def open_store(path):
+    """
+    ``VolumeStore`` for ``path``, opened once per process and reopened when
+    its ``meta.json`` is rewritten (a later run or a growing store).
+    """
+    key = str(Path(path).resolve())
+    st = os.stat(Path(key) / META)
+    stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+    s = _OPEN.get(key)
+    if s is None or s[0] != stamp:
+        s = _OPEN[key] = (stamp, VolumeStore(key))
+    return s[1]
+
+
+def add_store_args(ap):
+    ap.add_argument(
+        "--store",
+        action="store_true",
+        help="write chunked <name>.vol stores (one per series and method) "
+             "instead of one .npy per slice",
+    )
+    ap.add_argument(
+        "--compress",
+        action="store_true",
+        help="with --store: zlib-compress chunks (lossless, not mmap-able)",
+    )
@@ -0,0 +1,91 @@
+import numpy as np
+
+from src.utils.trace import traced
+from .fsim import fsim_features, fsim_from_features
+from .local_stats import LocalStats
+
+
+class MetricsEngine:
+    """
+    UIQI, SSIM and FSIM of many candidates against one reference.
+
+    Everything that depends only on the reference (local means and
+    variances for both window sizes, the phase congruency and gradient
+    maps for FSIM) is computed once in ``__init__``. UIQI and SSIM use the
+    float32 box filters of ``local_stats``, with the reference*candidate
+    product formed once per candidate and shared by both; ``score_stack``
+    computes the FSIM features of all candidates in one batch. FSIM is
+    identical to ``fsim``; UIQI and SSIM match ``uiqi`` and ``ssim01``
+    within ``local_stats.UIQI_TOLERANCE`` / ``SSIM_TOLERANCE``.
+
+    Parameters
+    ----------
+    ref01 : np.ndarray
+        Reference image in [0,1].
+    uiqi_win : int
+        UIQI box window (as ``uiqi(win_size=...)``).
+    ssim_win : int
+        SSIM box window (skimage default 7).
+    T1, T2 : float
+        FSIM stabilising constants (as ``fsim``).
+    """
+
+    names = ("UIQI", "SSIM", "FSIM")
+
+    @traced("engine.init")
+    def __init__(self, ref01, uiqi_win=8, ssim_win=7, T1=0.85, T2=160.0):
+        r = np.asarray(ref01).astype(np.float32)
+        self.ref = r
+        self.uiqi_win = uiqi_win
+        self.ssim_win = ssim_win
+        self.T1, self.T2 = T1, T2
+        # UIQI / SSIM reference moments
+        self.u = LocalStats(r, uiqi_win)
+        self.s = LocalStats(r, ssim_win)
+
+        # FSIM reference features
+        self.fsim_ref = fsim_features(r)
+
+    @traced("engine.uiqi")
+    def uiqi(self, img, prod=None):
+        return self.u.uiqi(img, prod)
+
+    @traced("engine.ssim")
+    def ssim(self, img, prod=None, data_range=1.0):
+        return self.s.ssim(img, prod, data_range)
+
+    def fsim(self, img):
+        return float(self.fsim_many([img])[0])
+
+    @traced("engine.fsim")
+    def fsim_many(self, imgs):
+        """FSIM of a sequence or (M, H, W) stack of candidates, one batch."""
+        cand = fsim_features(np.asarray(imgs, dtype=np.float32))
+        return fsim_from_features(self.fsim_ref, cand, self.T1, self.T2)
+
+    def score(self, img):
+        """(UIQI, SSIM, FSIM) of one candidate."""
+        img = np.asarray(img, dtype=np.float32)
+        prod = self.ref * img
+        return (self.uiqi(img, prod),
+                self.ssim(img, prod),
+                self.fsim(img))
+
+    def score_stack(self, imgs):
+        """
+        Score a sequence or (M, H, W) stack of candidates.
+
+        Returns
+        -------
+        np.ndarray
+            float64 array of shape (M, 3): UIQI, SSIM, FSIM per candidate.
+        """
+        imgs = np.asarray(imgs, dtype=np.float32)
+        out = np.empty((len(imgs), 3), dtype=np.float64)
+        prod = np.empty(self.ref.shape, dtype=np.float32)
+        for i, img in enumerate(imgs):
+            np.multiply(self.ref, img, out=prod)
+            out[i, 0] = self.uiqi(img, prod)
+            out[i, 1] = self.ssim(img, prod)
+        out[:, 2] = self.fsim_many(imgs)
+        return out
@@ -0,0 +1,126 @@
+"""
+Windowed local statistics in float32 for UIQI and SSIM.
+
+``box_mean`` and ``box_sq_mean`` are separable running-sum box filters
+(``cv2.boxFilter`` / ``cv2.sqrBoxFilter``, one pass per axis whatever the
+window size) with the same window placement and mirrored border as
+``scipy.ndimage.uniform_filter``; they agree with it to float32 rounding.
+``LocalStats`` holds the reference moments for one window and evaluates
+UIQI and SSIM candidate by candidate (``MetricsEngine.score_stack``),
+reusing one set of per-candidate buffers, so a slice needs a handful of
+float32 images rather than the float64 temporaries of
+``skimage.metrics.structural_similarity``.
+
+Scores match ``uiqi`` and ``ssim01`` within ``UIQI_TOLERANCE`` and
+``SSIM_TOLERANCE`` (absolute). On CT slices the difference is below 1e-6
+for both. UIQI's ``(num + 1e-8) / (den + 1e-8)`` is ill-conditioned
+where a window is exactly flat, so on piecewise-constant images (the
+Shepp-Logan phantom) float32 rounding of the variances moves it by up to
+~3e-5.
+"""
+import cv2
+import numpy as np
+
+UIQI_TOLERANCE = 1e-4
+SSIM_TOLERANCE = 1e-6
+
+_BORDER = cv2.BORDER_REFLECT  # scipy's "reflect": d c b a | a b c d
+
+
+def box_mean(x, k, out=None):
+    """k x k windowed mean of a 2D image or each slice of a stack."""
+    x = np.asarray(x, dtype=np.float32)
+    if x.ndim == 2:
+        return cv2.boxFilter(x, cv2.CV_32F, (k, k), dst=out, borderType=_BORDER)
+    out = np.empty_like(x) if out is None else out
+    for i in range(len(x)):
+        cv2.boxFilter(x[i], cv2.CV_32F, (k, k), dst=out[i], borderType=_BORDER)
+    return out
+
+
+def box_sq_mean(x, k, out=None):
+    """k x k windowed mean of ``x * x``, without forming ``x * x``."""
+    x = np.asarray(x, dtype=np.float32)
+    if x.ndim == 2:
+        return cv2.sqrBoxFilter(x, cv2.CV_32F, (k, k), dst=out, borderType=_BORDER)
+    out = np.empty_like(x) if out is None else out
+    for i in range(len(x)):
+        cv2.sqrBoxFilter(x[i], cv2.CV_32F, (k, k), dst=out[i], borderType=_BORDER)
+    return out
+
+
+class LocalStats:
+    """
+    Reference mean and variance for a ``k`` x ``k`` window, and per
+    candidate the mean, variance and covariance with the reference.
+
+    Parameters
+    ----------
+    ref01 : np.ndarray
+        Reference image in [0,1].
+    k : int
+        Window size.
+    """
+
+    def __init__(self, ref01, k):
+        self.ref = np.asarray(ref01, dtype=np.float32)
+        self.k = k
+        self.mu1 = box_mean(self.ref, k)
+        self.mu1_sq = self.mu1 * self.mu1
+        self.var1 = box_sq_mean(self.ref, k) - self.mu1_sq
+        shape = self.ref.shape
+        self._mu2, self._e22, self._e12 = (np.empty(shape, np.float32) for _ in range(3))
+        self._prod = np.empty(shape, np.float32)
+
+    def moments(self, img, prod=None):
+        """
+        (mu2, var2, cov12) of one candidate, as uncorrected window averages;
+        ``prod`` is ``ref * img`` if the caller already has it. The arrays
+        are reused by the next call.
+        """
+        img = np.asarray(img, dtype=np.float32)
+        k = self.k
+        mu2 = box_mean(img, k, out=self._mu2)
+        var2 = box_sq_mean(img, k, out=self._e22)
+        var2 -= mu2 * mu2
+        if prod is None:
+            prod = np.multiply(self.ref, img, out=self._prod)
+        cov = box_mean(prod, k, out=self._e12)
+        cov -= self.mu1 * mu2
+        return mu2, var2, cov
+
+    def uiqi(self, img, prod=None):
+        """UIQI as ``uiqi(ref, img, win_size=k)``."""
+        mu2, var2, cov = self.moments(img, prod)
+        mu12 = self.mu1 * mu2
+        num = 4 * mu12 * cov
+        num += 1e-8
+        mu2 *= mu2
+        mu2 += self.mu1_sq
+        var2 += self.var1
+        mu2 *= var2
+        mu2 += 1e-8
+        num /= mu2
+        return float(np.mean(num))
+
+    def ssim(self, img, prod=None, data_range=1.0):
+        """SSIM as ``ssim01`` (skimage defaults: k=7 uniform window, sample covariance)."""
+        k = self.k
+        cov_norm = np.float32(k * k / (k * k - 1))
+        mu2, var2, cov = self.moments(img, prod)
+        ux = self.mu1
+        C1 = (0.01 * data_range) ** 2
+        C2 = (0.03 * data_range) ** 2
+        a1 = 2 * ux * mu2 + C1
+        cov *= 2 * cov_norm
+        cov += C2                                    # A2
+        b1 = ux * ux + mu2 * mu2 + C1
+        var2 += self.var1
+        var2 *= cov_norm
+        var2 += C2                                   # B2
+        a1 *= cov
+        b1 *= var2
+        a1 /= b1
+        pad = (k - 1) // 2
+        return float(a1[pad:a1.shape[0] - pad, pad:a1.shape[1] - pad]
+                     .mean(dtype=np.float64))
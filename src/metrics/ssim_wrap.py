@@ -1,6 +1,8 @@
 import numpy as np
 from skimage.metrics import structural_similarity as ssim
+from src.utils.trace import traced
 
+@traced()
 def ssim01(img1, img2):
     # expects [0,1]
     return float(ssim(img1.astype(np.float32),
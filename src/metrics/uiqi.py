@@ -1,6 +1,8 @@
 import numpy as np
 from scipy.ndimage import uniform_filter
+from src.utils.trace import traced
 
+@traced()
 def uiqi(img1, img2, win_size=8):
     # expects [0,1]
     img1 = img1.astype(np.float32)
@@ -0,0 +1,310 @@
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from collections import namedtuple
+from datetime import datetime, timezone
+from pathlib import Path
+
+import cv2
+import numpy as np
+import scipy
+import skimage
+
+from src.enhan.clahe_baseline import clahe_baseline
+from src.enhan.ngc_clahe import ngc_clahe
+from src.enhan.nw_gc_clahe import W_LEVEL_BOUNDS, nw_gc_clahe
+from src.enhan.tiled import nw_gc_clahe_tiled
+from src.io.dicom_png import window_hu, window_img01
+from src.metrics.fsim import fsim
+from src.metrics.ssim_wrap import ssim01
+from src.metrics.uiqi import uiqi
+from src.utils import degrade, degrade_v2
+from src.utils.cache import code_version
+from src.utils.phantom import phantom_stack
+
+# Every benchmark is one call per slice on a prepared ``Slice``: ``hu`` in
+# HU, ``img01`` its soft-tissue window in [0,1] and ``deg01`` the strongly
+# degraded version (the enhancers' input and the metrics' candidate).
+Slice = namedtuple("Slice", ["hu", "img01", "deg01"])
+
+BENCHES = {
+    "clahe_baseline": lambda s: clahe_baseline(s.deg01),
+    "ngc_clahe": lambda s: ngc_clahe(s.deg01),
+    "nw_gc_clahe": lambda s: nw_gc_clahe(s.deg01),
+    "nw_gc_clahe_tiled": lambda s: nw_gc_clahe_tiled(s.deg01, budget_mb=16),
+    "nw_gc_clahe_w1": lambda s: nw_gc_clahe(s.deg01, w_level=1),
+    "uiqi": lambda s: uiqi(s.img01, s.deg01),
+    "ssim01": lambda s: ssim01(s.img01, s.deg01),
+    "fsim": lambda s: fsim(s.img01, s.deg01),
+    "window_hu": lambda s: window_hu(s.hu, 40, 400),
+    "window_img01": lambda s: window_img01(s.img01),
+    "degrade_v1": lambda s: degrade.degrade_low_contrast(s.img01, strength="strong"),
+    "degrade_v2": lambda s: degrade_v2.degrade_low_contrast(s.img01, strength="strong"),
+}
+
+
+def ints(s):
+    return [int(v) for v in s.split(",") if v.strip()]
+
+
+def names(s, known):
+    out = list(known) if s == "all" else [v.strip() for v in s.split(",") if v.strip()]
+    unknown = [v for v in out if v not in known]
+    if unknown:
+        raise argparse.ArgumentTypeError(
+            f"unknown {unknown}; choose from {', '.join(known)} or 'all'")
+    return out
+
+
+def prepare(kind, n, depth, distinct):
+    """Phantom stack as ``Slice`` tuples (``distinct`` generated, then repeated)."""
+    stack = phantom_stack(kind, n, min(depth, distinct))
+    slices = []
+    for x in stack:
+        # the Shepp-Logan phantom is [0,1]; give it the HU range of the window
+        hu = x * np.float32(400) - np.float32(160) if kind == "shepp" else x
+        img01 = window_hu(hu, 40, 400).astype(np.float32)
+        slices.append(Slice(hu, img01, degrade.degrade_low_contrast(img01, strength="strong")))
+    return [slices[i % len(slices)] for i in range(depth)]
+
+
+def peak_mb(fn, s):
+    """Peak extra memory (MiB) of one call, as seen by tracemalloc."""
+    tracemalloc.start()
+    try:
+        base = tracemalloc.get_traced_memory()[0]
+        fn(s)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return (peak - base) / 2**20
+
+
+def bench_one(name, slices, repeat, min_time=0.2):
+    """
+    Best seconds for one pass over ``slices`` and peak memory. At least
+    ``repeat`` passes are timed, and more while their total is under
+    ``min_time``, so sub-millisecond cases are not dominated by jitter.
+    """
+    fn = BENCHES[name]
+    fn(slices[0])  # warm-up: imports, lru caches, CLAHE objects
+    best, spent, passes = float("inf"), 0.0, 0
+    while passes < max(1, repeat) or (spent < min_time and passes < 1000):
+        t0 = time.perf_counter()
+        for s in slices:
+            fn(s)
+        dt = time.perf_counter() - t0
+        best, spent, passes = min(best, dt), spent + dt, passes + 1
+    return best, peak_mb(fn, slices[0])
+
+
+def environment():
+    return {
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpus": cv2.getNumberOfCPUs(),
+        "cv2_threads": cv2.getNumThreads(),
+        "numpy": np.__version__,
+        "scipy": scipy.__version__,
+        "skimage": skimage.__version__,
+        "opencv": cv2.__version__,
+        "code_version": code_version(),
+    }
+
+
+def run(args):
+    results = []
+    print(f"{'bench':<20}{'phantom':<8}{'size':>6}{'depth':>6}{'s':>10}"
+          f"{'slices/s':>11}{'MPix/s':>9}{'peak MB':>9}")
+    for kind in args.phantoms:
+        for n in args.sizes:
+            for depth in args.depths:
+                mpix = n * n * depth / 1e6
+                if args.max_mpix and mpix > args.max_mpix:
+                    print(f"# skip {kind} {n}px x {depth}: {mpix:.0f} MPix > --max-mpix")
+                    continue
+                slices = prepare(kind, n, depth, args.distinct)
+                for name in args.benches:
+                    secs, peak = bench_one(name, slices, args.repeat, args.min_time)
+                    r = {
+                        "bench": name, "phantom": kind, "size": n, "depth": depth,
+                        "seconds": secs,
+                        "slices_per_s": depth / secs,
+                        "mpix_per_s": mpix / secs,
+                        "peak_mb": peak,
+                    }
+                    results.append(r)
+                    print(f"{name:<20}{kind:<8}{n:>6}{depth:>6}{secs:>10.4f}"
+                          f"{r['slices_per_s']:>11.1f}{r['mpix_per_s']:>9.1f}{peak:>9.1f}",
+                          flush=True)
+                del slices
+
+    env = environment()
+    # resource is POSIX-only; ru_maxrss is KiB on Linux
+    try:
+        import resource
+        env["max_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    except ImportError:
+        pass
+    doc = {"meta": env, "settings": {"repeat": args.repeat, "min_time": args.min_time,
+                                       "distinct": args.distinct},
+           "results": results}
+    out = Path(args.out)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(doc, f, indent=1)
+    print(f"\nSaved benchmark results to {out}")
+
+    if args.compare:
+        return compare(args.compare, out, args.tolerance, args.mem_tolerance)
+    return 0
+
+
+def _key(r):
+    return r["bench"], r["phantom"], r["size"], r["depth"]
+
+
+def compare(base_path, new_path, tolerance=0.10, mem_tolerance=0.10):
+    """
+    Print new vs baseline throughput and peak memory per case; return 1 if
+    any case got slower than ``1 - tolerance`` of the baseline or its peak
+    memory grew by more than ``mem_tolerance`` (plus 1 MB of slack).
+    """
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+
+    for k in ("machine", "cpus", "numpy", "opencv"):
+        a, b = base["meta"].get(k), new["meta"].get(k)
+        if a != b:
+            print(f"# note: {k} differs ({a} -> {b}); timings may not be comparable")
+
+    old = {_key(r): r for r in base["results"]}
+    regressions = 0
+    print(f"{'bench':<20}{'phantom':<8}{'size':>6}{'depth':>6}"
+          f"{'base sl/s':>11}{'new sl/s':>10}{'ratio':>7}{'base MB':>9}{'new MB':>8}  status")
+    for r in new["results"]:
+        b = old.pop(_key(r), None)
+        head = f"{r['bench']:<20}{r['phantom']:<8}{r['size']:>6}{r['depth']:>6}"
+        if b is None:
+            print(f"{head}{'-':>11}{r['slices_per_s']:>10.1f}{'':>7}{'-':>9}"
+                  f"{r['peak_mb']:>8.1f}  new")
+            continue
+        ratio = r["slices_per_s"] / b["slices_per_s"]
+        status = []
+        if ratio < 1.0 - tolerance:
+            status.append("SLOWER")
+        if r["peak_mb"] > b["peak_mb"] * (1.0 + mem_tolerance) + 1.0:
+            status.append("MEMORY")
+        regressions += bool(status)
+        print(f"{head}{b['slices_per_s']:>11.1f}{r['slices_per_s']:>10.1f}{ratio:>7.2f}"
+              f"{b['peak_mb']:>9.1f}{r['peak_mb']:>8.1f}  {' '.join(status) or 'ok'}")
+    if old:
+        print(f"# {len(old)} baseline case(s) not in the new results")
+
+    print(f"\n{regressions} regression(s) beyond {tolerance:.0%} time / "
+          f"{mem_tolerance:.0%} memory")
+    return 1 if regressions else 0
+
+
+def accuracy(args):
+    """
+    Worst |delta| of UIQI / SSIM against the clean slice between each
+    approximate ``nw_gc_clahe(w_level=L)`` and the exact path, per phantom
+    and size; return 1 if any exceeds ``W_LEVEL_BOUNDS[L]``.
+    """
+    print(f"{'phantom':<8}{'size':>6}{'level':>6}{'|dUIQI|':>10}{'|dSSIM|':>10}"
+          f"{'bound U/S':>16}  status")
+    failures = 0
+    for kind in args.phantoms:
+        for n in args.sizes:
+            worst = {level: [0.0, 0.0] for level in W_LEVEL_BOUNDS}
+            for s in prepare(kind, n, args.distinct, args.distinct):
+                exact = nw_gc_clahe(s.deg01)[0]
+                base = uiqi(s.img01, exact), ssim01(s.img01, exact)
+                for level, w in worst.items():
+                    approx = nw_gc_clahe(s.deg01, w_level=level)[0]
+                    w[0] = max(w[0], abs(uiqi(s.img01, approx) - base[0]))
+                    w[1] = max(w[1], abs(ssim01(s.img01, approx) - base[1]))
+            for level, (du, ds) in worst.items():
+                bu, bs = W_LEVEL_BOUNDS[level]
+                ok = du <= bu and ds <= bs
+                failures += not ok
+                print(f"{kind:<8}{n:>6}{level:>6}{du:>10.1e}{ds:>10.1e}"
+                      f"{f'{bu:.0e}/{bs:.0e}':>16}  {'ok' if ok else 'EXCEEDED'}", flush=True)
+    print(f"\n{failures} case(s) over the documented bound")
+    return 1 if failures else 0
+
+
+def main():
+    ap = argparse.ArgumentParser(
+        description="time methods and metrics on synthetic phantoms"
+    )
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    r = sub.add_parser("run", help="run the benchmarks and save JSON results")
+    r.add_argument("--sizes", type=ints, default=[256, 512, 1024, 2048], help="slice sizes (px)")
+    r.add_argument("--depths", type=ints, default=[1, 64, 512], help="stack depths (slices)")
+    r.add_argument(
+        "--phantoms",
+        type=lambda s: names(s, ("shepp", "ct")),
+        default=["shepp", "ct"],
+        help="comma list of shepp,ct or 'all'",
+    )
+    r.add_argument(
+        "--benches",
+        type=lambda s: names(s, tuple(BENCHES)),
+        default=list(BENCHES),
+        help=f"comma list of {','.join(BENCHES)} or 'all'",
+    )
+    r.add_argument("--repeat", type=int, default=3, help="passes per case; the best is kept")
+    r.add_argument("--min-time", type=float, default=0.2,
+                   help="keep adding passes until this many seconds were timed")
+    r.add_argument(
+        "--distinct",
+        type=int,
+        default=8,
+        help="distinct slices generated per stack; deeper stacks repeat them",
+    )
+    r.add_argument("--max-mpix", type=float, default=0,
+                   help="skip cases with more megapixels than this (0 = no limit)")
+    r.add_argument("--out", default="data/bench/results.json", help="results JSON")
+    r.add_argument("--compare", default=None, help="baseline JSON to compare against")
+
+    c = sub.add_parser("compare", help="flag regressions of results against a baseline")
+    c.add_argument("baseline", help="baseline results JSON")
+    c.add_argument("results", help="new results JSON")
+
+    a = sub.add_parser("accuracy",
+                       help="check nw_gc_clahe's low-res W modes against their error bounds")
+    a.add_argument("--sizes", type=ints, default=[256, 512, 1024, 2048], help="slice sizes (px)")
+    a.add_argument(
+        "--phantoms",
+        type=lambda s: names(s, ("shepp", "ct")),
+        default=["shepp", "ct"],
+        help="comma list of shepp,ct or 'all'",
+    )
+    a.add_argument("--distinct", type=int, default=4, help="slices per phantom and size")
+
+    for p in (r, c):
+        p.add_argument("--tolerance", type=float, default=0.10,
+                       help="allowed throughput drop (fraction)")
+        p.add_argument("--mem-tolerance", type=float, default=0.10,
+                       help="allowed peak-memory growth (fraction)")
+    args = ap.parse_args()
+
+    if args.cmd == "run":
+        sys.exit(run(args))
+    if args.cmd == "accuracy":
+        sys.exit(accuracy(args))
+    sys.exit(compare(args.baseline, args.results, args.tolerance, args.mem_tolerance))
+
+
+if __name__ == "__main__":
+    main()
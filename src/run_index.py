@@ -0,0 +1,34 @@
+import argparse
+from collections import Counter
+
+from src.io.index import DatasetIndex
+
+
+def main():
+    ap = argparse.ArgumentParser(description="build / refresh the dataset header index")
+    ap.add_argument("--src", default="data/real", help="folder to index (recursive)")
+    ap.add_argument("--db", default=None,
+                    help="index file (default SRC/.dsindex.sqlite, or one under "
+                         "data/cache/index if SRC is read-only)")
+    ap.add_argument("--list", action="store_true", help="print every indexed file")
+    args = ap.parse_args()
+
+    with DatasetIndex(args.src, db=args.db) as idx:
+        changed, removed, unchanged = idx.update()
+        print(f"{changed} new/changed, {removed} removed, {unchanged} unchanged")
+
+        entries = idx.entries()
+        kinds = Counter(e.kind for e in entries)
+        print(", ".join(f"{n} {k}" for k, n in sorted(kinds.items())) or "no files")
+        for uid, sl in idx.series().items():
+            print(f"series {uid}: {len(sl)} slices, {sl[0].rows}x{sl[0].cols}")
+        for e in entries:
+            if e.error:
+                print(f"# unreadable {e.path}: {e.error}")
+            elif args.list:
+                print(f"{e.path}\t{e.kind}\t{e.rows}x{e.cols}\t{e.position}")
+        print(f"Index at {idx.db}")
+
+
+if __name__ == "__main__":
+    main()
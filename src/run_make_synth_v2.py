@@ -1,16 +1,36 @@
 import argparse
+from functools import partial
 from pathlib import Path
 
 import numpy as np
 
-from src.io.dicom_png import (
-    is_dicom,
-    read_dicom_hu,
-    read_gray01,
-    window_hu,
-    window_img01,
-)
+from src.io.dicom_png import parse_windows, read_windowed01_multi
 from src.utils.degrade import degrade_low_contrast
+from src.io.index import add_index_arg, list_inputs, list_series
+from src.io.prefetch import BackgroundWriter
+from src.io.volume_store import SeriesWriter, add_store_args
+from src.utils import trace
+from src.utils.parallel import add_workers_arg, map_slices
+
+
+def make_one(p, dsts, strength, store=False, data=None, save=np.save):
+    # --- load once, window to [0,1] for every requested preset ---
+    wins = read_windowed01_multi(p, list(dsts)) if data is None else data
+
+    out_paths = []
+    for mode, img01 in wins.items():
+        # --- apply low-contrast degradation (no noise) ---
+        deg01 = degrade_low_contrast(img01, strength=strength)
+        if store:
+            # appended to the preset's store by the parent
+            out_paths.append((mode, deg01.astype(np.float32)))
+            continue
+
+        # save as lossless .npy (float32 in [0,1])
+        out_path = dsts[mode] / f"{p.stem}.npy"
+        save(out_path, deg01.astype(np.float32))
+        out_paths.append(out_path)
+    return out_paths
 
 
 def main():
@@ -28,8 +48,8 @@ def main():
     ap.add_argument(
         "--mode",
         default="soft",
-        choices=["soft", "lung"],
-        help="CT window preset (soft tissue vs lung)",
+        help="CT window preset(s): soft, lung, bone, subdural, a comma list "
+             "or 'all'; several presets write one subfolder each",
     )
     ap.add_argument(
         "--strength",
@@ -37,37 +57,62 @@ def main():
         choices=["mild", "medium", "strong"],
         help="amount of synthetic contrast reduction",
     )
+    add_workers_arg(ap)
+    add_index_arg(ap)
+    add_store_args(ap)
+    trace.add_trace_args(ap)
     args = ap.parse_args()
+    trace.start(args)
 
     # CT window presets similar to those used in the base paper
-    if args.mode == "lung":
-        wl, ww = -600, 1500
-    else:  # "soft" – brain / soft-tissue style window
-        wl, ww = 40, 400
+    try:
+        modes = parse_windows(args.mode)
+    except ValueError as e:
+        ap.error(str(e))
 
     src = Path(args.src)
     dst = Path(args.dst)
-    dst.mkdir(parents=True, exist_ok=True)
+    # one preset keeps the flat layout; fan-out gets dst/<preset>/
+    dsts = {m: dst if len(modes) == 1 else dst / m for m in modes}
+    for d in dsts.values():
+        d.mkdir(parents=True, exist_ok=True)
 
-    for p in sorted(src.iterdir()):
-        if p.is_dir():
-            continue
-
-        # --- load and window to [0,1] ---
-        if is_dicom(p):
-            hu = read_dicom_hu(p)
-            img01 = window_hu(hu, wl, ww)      # float in [0,1]
-        else:
-            g = read_gray01(p)
-            img01 = window_img01(g)            # float in [0,1]
-
-        # --- apply low-contrast degradation (no noise) ---
-        deg01 = degrade_low_contrast(img01, strength=args.strength)
-
-        # save as lossless .npy (float32 in [0,1])
-        out_path = dst / f"{p.stem}.npy"
-        np.save(out_path, deg01.astype(np.float32))
-        print(f"saved {out_path}")
+    paths = list_inputs(src, args.index, args.index_db)
+    writers, sid = {}, {}
+    if args.store:
+        # one store per series (and slice shape) and preset
+        series = list_series(src, args.index, args.index_db)
+        paths = [p for group in series for p in group]
+        sid = {p: i for i, group in enumerate(series) for p in group}
+        writers = {m: SeriesWriter(d, "synth", compress=args.compress)
+                   for m, d in dsts.items()}
+    # serial runs write on a background thread while the next slice is made
+    bg = BackgroundWriter() if args.workers == 1 and not args.store else None
+    job = partial(make_one, dsts=dsts, strength=args.strength, store=args.store,
+                  **({"save": bg.save} if bg else {}))
+    load = partial(read_windowed01_multi, names=list(dsts))
+    try:
+        for p, out_paths, err in map_slices(job, paths, workers=args.workers,
+                                            load=load, prefetch=args.prefetch):
+            if err:
+                print(f"# failed {p.name}: {err}")
+                continue
+            if args.store:
+                try:
+                    for mode, deg01 in out_paths:
+                        writers[mode].append(p.stem, deg01, series=sid[p])
+                except Exception as e:
+                    print(f"# failed {p.name}: {type(e).__name__}: {e}")
+                    continue
+                print(f"stored {p.name}")
+                continue
+            for out_path in out_paths:
+                print(f"saved {out_path}")
+    finally:
+        for w in writers.values():
+            w.close()
+    if bg:
+        bg.close()
 
     print(f"\nSynthetic degraded set saved to: {dst}")
 
@@ -1,4 +1,5 @@
 import argparse
+from functools import partial
 from pathlib import Path
 
 import numpy as np
@@ -7,12 +8,127 @@ from src.io.dicom_png import (
     is_dicom,
     read_dicom_hu,
     read_gray01,
-    window_hu,
-    window_img01,
+    WINDOWS,
 )
-from src.enhan.clahe_baseline import clahe_baseline
-from src.enhan.ngc_clahe import ngc_clahe
-from src.enhan.nw_gc_clahe import nw_gc_clahe
+from src.enhan.graph import STAGES, Executor
+from src.enhan.methods import METHODS, SERIES, STREAMS, build_slice, stream
+from src.enhan.series import MODES
+from src.io.index import add_index_arg, list_inputs, list_series
+from src.io.prefetch import BackgroundWriter, prefetch
+from src.io.volume_store import (
+    SeriesWriter, SliceRef, add_store_args, is_store, list_stores, open_store,
+)
+from src.utils.cache import (
+    add_cache_args, array_digest, cache_spec, file_digest, open_cache, result_key,
+)
+from src.utils import trace
+from src.utils.parallel import add_workers_arg, map_slices
+
+
+def input_kind(p):
+    if isinstance(p, SliceRef) or p.suffix.lower() == ".npy":
+        return "npy"
+    return "hu" if is_dicom(p) else "pct"
+
+
+def load_input(p):
+    """Degraded image and how to window it: (raw, "npy" | "hu" | "pct")."""
+    kind = input_kind(p)
+    if isinstance(p, SliceRef):
+        return p.load(), kind
+    if kind == "npy":
+        return np.load(p), kind
+    if kind == "hu":
+        # fallback: load DICOM / PNG and window on the fly
+        return read_dicom_hu(p), kind
+    return read_gray01(p), kind
+
+
+def cache_keys(p, names, wl, ww, bits, w_level=0, budget_mb=None):
+    """
+    Result-cache key per method for this input: its digest and the method's
+    fully resolved stage graph (every stage and parameter ``enhance_one``
+    would run).
+    """
+    digest = array_digest(p.load()) if isinstance(p, SliceRef) else file_digest(p)
+    _, targets = build_slice(names, input_kind(p), wl, ww, bits, budget_mb, w_level)
+    return {n: result_key(digest, n, {"graph": repr(t)}) for n, t in targets.items()}
+
+
+def load_uncached(p, names, wl, ww, bits, cache, w_level=0, budget_mb=None):
+    """
+    Prefetch loader: ``(keys, loaded)`` for ``enhance_one``, so the input
+    digest is taken once. ``keys`` is empty without a cache and ``loaded``
+    is None when every method is a cache hit.
+    """
+    rc = open_cache(cache)
+    keys = cache_keys(p, names, wl, ww, bits, w_level, budget_mb) if rc else {}
+    if keys and all(rc.has(k) for k in keys.values()):
+        return keys, None
+    return keys, load_input(p)
+
+
+def enhance_one(p, out, names, wl, ww, bits=8, store=False, data=None, save=np.save,
+                cache=None, budget_mb=None, w_level=0):
+    stem = p.stem
+
+    # --- results of unchanged inputs/settings come from the cache ---
+    rc = open_cache(cache)
+    if data is None:
+        keys, loaded = (cache_keys(p, names, wl, ww, bits, w_level, budget_mb) if rc else {}), None
+    else:
+        keys, loaded = data
+    hits = {n: rc.get(k) for n, k in keys.items()}
+    todo = [n for n in names if hits.get(n) is None]
+
+    results = {}
+    if todo:
+        # --- load degraded image; windowing is the first graph stage ---
+        raw, kind = load_input(p) if loaded is None else loaded
+        src_node, targets = build_slice(todo, kind, wl, ww, bits, budget_mb, w_level)
+
+        # --- selected methods; shared stages run once per slice ---
+        results = Executor({src_node: raw}).run(targets)
+        results = {n: img.astype(np.float32) for n, img in results.items()}
+        if rc:
+            for n, img in results.items():
+                rc.put(keys[n], img)
+    results = {n: results[n] if n in results else hits[n] for n in names}
+
+    if store:
+        # written by the parent, one store per method
+        return results
+
+    for name, img in results.items():
+        save(out / f"{stem}_{name}.npy", img)
+
+
+def enhance_series(paths, names, wl, ww, bits=8, slab=5, depth=4, incremental=None,
+                   window=5):
+    """
+    Slab-mode (or, with ``incremental``, series-mode) enhancement of one
+    series in slice order.
+
+    Yields ``(path, {name: img})`` per slice; slices that fail to load are
+    reported and left out of the series.
+    """
+    def windowed():
+        for p, data, err in prefetch(paths, load_input, depth=max(depth, 1)):
+            if err:
+                print(f"# failed {p.name}: {err}")
+                continue
+            raw, kind = data
+            done.append(p)
+            yield STAGES["window"](raw, kind=kind, wl=wl, ww=ww)
+
+    done = []   # loaded paths, in the order their outputs come out
+    params = {n: {"bins": 1 << bits} for n in names}
+    if incremental:
+        kw = {"streams": SERIES, "mode": incremental, "window": window}
+    else:
+        kw = {"streams": STREAMS, "slab": slab}
+    for i, results in enumerate(stream(names, windowed(), params=params, **kw)):
+        yield done[i], {n: img.astype(np.float32) for n, img in results.items()}
 
 
 def main():
@@ -20,7 +136,7 @@ def main():
     ap.add_argument(
         "--src",
         default="data/synth",
-        help="folder of degraded images (.npy or PNG/DICOM)",
+        help="folder of degraded images (.npy or PNG/DICOM) or a .vol store",
     )
     ap.add_argument(
         "--out",
@@ -30,68 +146,141 @@ def main():
     ap.add_argument(
         "--mode",
         default="soft",
-        choices=["soft", "lung"],
+        choices=list(WINDOWS),
         help="window preset if loading PNG/DICOM directly",
     )
+    ap.add_argument(
+        "--methods",
+        default=",".join(METHODS),
+        help="comma-separated subset of: " + ", ".join(METHODS),
+    )
+    ap.add_argument(
+        "--bits",
+        type=int,
+        default=8,
+        choices=[8, 10, 12, 14, 16],
+        help="CLAHE grey-level depth (histogram bins = 2**bits)",
+    )
+    ap.add_argument(
+        "--slab",
+        type=int,
+        default=1,
+        help="3D CLAHE: contextual regions span this many slices of a series "
+             "(odd; 1 = per-slice). Runs serially and bypasses the result cache",
+    )
+    ap.add_argument(
+        "--budget-mb",
+        type=float,
+        default=0,
+        help="run the proposed method block by block with at most this much "
+             "working memory per slice (0 = whole slice in memory)",
+    )
+    ap.add_argument(
+        "--w-level",
+        type=int,
+        default=0,
+        choices=[0, 1, 2],
+        help="preview mode: compute the proposed method's edge / noise / weight "
+             "maps this many pyramid levels down (0 = exact)",
+    )
+    ap.add_argument(
+        "--incremental",
+        default=None,
+        choices=list(MODES),
+        help="series mode: carry NGC / edge / noise ranges and CLAHE histograms "
+             "across slices, smoothed (ema) or reused from key slices (carry). "
+             "Both reduce flicker; only carry skips work on non-key slices, "
+             "ema still computes every statistic per slice. "
+             "Runs serially and bypasses the result cache",
+    )
+    ap.add_argument(
+        "--series-window",
+        type=int,
+        default=5,
+        help="--incremental: EMA span or slices per key slice",
+    )
+    add_workers_arg(ap)
+    add_index_arg(ap)
+    add_store_args(ap)
+    add_cache_args(ap)
+    trace.add_trace_args(ap)
     args = ap.parse_args()
+    trace.start(args)
+
+    names = [m.strip() for m in args.methods.split(",") if m.strip()]
+    unknown = [m for m in names if m not in METHODS]
+    if unknown:
+        ap.error(f"unknown method(s): {', '.join(unknown)}")
+    if args.slab > 1 and args.incremental:
+        ap.error("--slab and --incremental are alternative series modes")
+    if (args.slab > 1 or args.incremental) and (args.w_level or args.budget_mb):
+        ap.error("--w-level and --budget-mb apply to per-slice runs, not to --slab / --incremental")
 
     # CT window presets (only used if src has DICOM/PNG instead of .npy)
-    if args.mode == "lung":
-        wl, ww = -600, 1500
-    else:  # soft-tissue / brain style
-        wl, ww = 40, 400
+    wl, ww = WINDOWS[args.mode]
 
     src = Path(args.src)
     out = Path(args.out)
     out.mkdir(parents=True, exist_ok=True)
 
-    for p in sorted(src.iterdir()):
-        if p.is_dir():
-            continue
-
-        stem = p.stem
-
-        # --- load degraded image as float32 in [0,1] ---
-        if p.suffix.lower() == ".npy":
-            img01 = np.load(p).astype(np.float32)
-            # in case someone saved as 0-255 by mistake
-            if img01.max() > 1.001:
-                img01 = img01 / 255.0
-            img01 = np.clip(img01, 0.0, 1.0)
-        else:
-            # fallback: load DICOM / PNG and window on the fly
-            if is_dicom(p):
-                hu = read_dicom_hu(p)
-                img01 = window_hu(hu, wl, ww)
-            else:
-                g = read_gray01(p)
-                img01 = window_img01(g)
-
-        # --- method 1: plain CLAHE baseline ---
-        cla = clahe_baseline(img01, clip=2.0, tile=(8, 8))
-
-        # --- method 2: NGC-CLAHE (paper baseline) ---
-        base = ngc_clahe(
-            img01,
-            gamma=0.95,
-            clip=2.0,
-            tile=(8, 8),
-        )
-
-        # --- method 3: Proposed NW-GC-CLAHE ---
-        prop, _maps = nw_gc_clahe(
-            img01,
-            gamma=0.95,
-            clip_cons=1.0,
-            clip_agg=3.0,
-            tile=(8, 8),
-        )
-
-        np.save(out / f"{stem}_clahe.npy", cla.astype(np.float32))
-        np.save(out / f"{stem}_ngcclahe.npy", base.astype(np.float32))
-        np.save(out / f"{stem}_proposed.npy", prop.astype(np.float32))
-
-        print(f"processed {p.name}")
+    # stores written by run_make_synth --store are read in place, one series each
+    stores = [src] if is_store(src) else list_stores(src, "synth")
+    if stores:
+        series = [open_store(s).refs() for s in stores]
+    elif args.slab > 1 or args.incremental or args.store:
+        series = list_series(src, args.index, args.index_db)
+    else:
+        series = [list_inputs(src, args.index, args.index_db)]
+    paths = [p for group in series for p in group]
+    sid = {p: i for i, group in enumerate(series) for p in group}
+
+    writers = {}
+    if args.store:
+        # one store per series (and slice shape) and method
+        writers = {n: SeriesWriter(out, n, compress=args.compress) for n in names}
+    # serial runs write on a background thread while the next slice is enhanced
+    by_series = args.slab > 1 or bool(args.incremental)
+    serial = args.workers == 1 or by_series
+    bg = BackgroundWriter() if serial and not args.store else None
+    save = bg.save if bg else np.save
+
+    if by_series:
+        # one series at a time, slices in order; outputs come back to be saved
+        results = ((p, res, None) for group in series
+                   for p, res in enhance_series(group, names, wl, ww, bits=args.bits,
+                                                slab=args.slab, depth=args.prefetch,
+                                                incremental=args.incremental,
+                                                window=args.series_window))
+    else:
+        cache = cache_spec(args)
+        job = partial(enhance_one, out=out, names=names, wl=wl, ww=ww, bits=args.bits,
+                      store=args.store, cache=cache, save=save, budget_mb=args.budget_mb,
+                      w_level=args.w_level)
+        load = partial(load_uncached, names=names, wl=wl, ww=ww, bits=args.bits,
+                       cache=cache, w_level=args.w_level, budget_mb=args.budget_mb)
+        results = map_slices(job, paths, workers=args.workers,
+                             load=load, prefetch=args.prefetch)
+    try:
+        for p, res, err in results:
+            if err:
+                print(f"# failed {p.name}: {err}")
+                continue
+            try:
+                for name, img in (res or {}).items():
+                    if args.store:
+                        writers[name].append(p.stem, img, series=sid[p])
+                    else:
+                        save(out / f"{p.stem}_{name}.npy", img)
+            except Exception as e:
+                print(f"# failed {p.name}: {type(e).__name__}: {e}")
+                continue
+            print(f"processed {p.name}")
+    finally:
+        # stores are readable up to their last slice even after an error
+        for w in writers.values():
+            w.close()
+    if bg:
+        bg.close()
 
     print(f"\nEnhanced outputs saved to {out}")
 
@@ -1,50 +1,129 @@
 import argparse
+from functools import partial
 from pathlib import Path
 import csv
 
 import numpy as np
 import matplotlib.pyplot as plt
 
-from src.metrics.uiqi import uiqi
-from src.metrics.ssim_wrap import ssim01
-from src.metrics.fsim import fsim
-from src.io.dicom_png import (
-    is_dicom,
-    read_dicom_hu,
-    read_gray01,
-    window_hu,
-    window_img01,
+from src.metrics.engine import MetricsEngine
+from src.io.dicom_png import WINDOWS, read_windowed01
+from src.io.index import add_index_arg, list_inputs
+from src.io.volume_store import list_stores, open_store
+from src.utils.cache import (
+    add_cache_args, array_digest, cache_spec, file_digest, open_cache, result_key,
 )
+from src.utils import trace
+from src.utils.parallel import add_workers_arg, map_slices
 
 
 def load_ref01(path: Path, wl: float, ww: float) -> np.ndarray:
     """Load reference CT slice and map to [0,1]."""
-    if is_dicom(path):
-        hu = read_dicom_hu(path)
-        x = window_hu(hu, wl, ww)
+    return read_windowed01(path, wl, ww)
+
+
+def output_loader(p_out, stem, name):
+    """
+    Loader for one method output (in one of the ``<name>.vol`` stores or
+    ``<stem>_<name>.npy``) and a digest function for it, or None.
+    """
+    stores = list_stores(p_out, name)
+    if stores:
+        for store in stores:
+            s = open_store(store)
+            if stem in s:
+                return (lambda: s[stem]), (lambda: array_digest(s[stem]))
+        return None
+    path = p_out / f"{stem}_{name}.npy"
+    if not path.exists():
+        return None
+    return (lambda: np.load(path)), (lambda: file_digest(path))
+
+
+def output_loaders(p_out, stem):
+    return [output_loader(p_out, stem, n) for n in ("clahe", "ngcclahe", "proposed")]
+
+
+def score_key(r, loaders, wl, ww):
+    digests = [file_digest(r)] + [dg() for _, dg in loaders]
+    return result_key(digests, "metrics", {"wl": wl, "ww": ww})
+
+
+def load_uncached(r, p_out, wl, ww, cache):
+    """
+    Prefetch loader: ``(loaders, key, ref01)`` for ``score_one``, so the
+    digests are taken once. ``key`` is None without a cache and ``ref01``
+    is None when the row is cached (or an output is missing).
+    """
+    loaders = output_loaders(p_out, r.stem)
+    if not all(loaders):
+        return loaders, None, None
+    rc = open_cache(cache)
+    key = score_key(r, loaders, wl, ww) if rc else None
+    if key is not None and rc.has(key):
+        return loaders, key, None
+    return loaders, key, load_ref01(r, wl, ww)
+
+
+def score_one(r, p_out, wl, ww, data=None, cache=None):
+    """UIQI/SSIM/FSIM of the three outputs for one reference, or None."""
+    if data is None:
+        loaders, key, ref01 = output_loaders(p_out, r.stem), None, None
     else:
-        g = read_gray01(path)
-        x = window_img01(g)
-    return np.clip(x.astype(np.float32), 0.0, 1.0)
+        loaders, key, ref01 = data
+    if not all(loaders):
+        return None
+
+    # rows for unchanged reference + outputs come from the cache
+    rc = open_cache(cache)
+    if rc:
+        if key is None:
+            key = score_key(r, loaders, wl, ww)
+        row = rc.get(key)
+        if row is not None:
+            return tuple(row)
+
+    if ref01 is None:
+        ref01 = load_ref01(r, wl, ww)
+
+    with trace.span("load"):
+        cla, ngc, prop = (ld().astype(np.float32) for ld, _ in loaders)
+
+    # ensure all are in [0,1]
+    for x in (cla, ngc, prop):
+        x[x < 0.0] = 0.0
+        x[x > 1.0] = 1.0
+
+    # reference statistics are computed once for all three candidates
+    scores = MetricsEngine(ref01).score_stack((cla, ngc, prop))
+    row = scores.ravel().tolist()
+    if rc:
+        rc.put(key, row)
+    return tuple(row)
 
 
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--ref", default="data/real", help="clean reference images (PNG/DICOM)")
-    ap.add_argument("--out", default="data/outputs", help="folder with enhanced outputs (.npy)")
+    ap.add_argument(
+        "--out",
+        default="data/outputs",
+        help="folder with enhanced outputs (.npy or <method>.vol stores)",
+    )
     ap.add_argument(
         "--mode",
         default="soft",
-        choices=["soft", "lung"],
+        choices=list(WINDOWS),
         help="CT window preset for reference",
     )
+    add_workers_arg(ap)
+    add_index_arg(ap)
+    add_cache_args(ap)
+    trace.add_trace_args(ap)
     args = ap.parse_args()
+    trace.start(args)
 
-    if args.mode == "lung":
-        wl, ww = -600, 1500
-    else:
-        # "soft" – brain / soft-tissue style window (you can change to 40,80 if desired)
-        wl, ww = 40, 400
+    wl, ww = WINDOWS[args.mode]
 
     p_ref = Path(args.ref)
     p_out = Path(args.out)
@@ -57,47 +136,24 @@ def main():
         "UIQI_ngc, SSIM_ngc, FSIM_ngc, UIQI_prop, SSIM_prop, FSIM_prop"
     )
 
-    for r in sorted(p_ref.iterdir()):
-        if r.is_dir():
-            continue
+    refs = list_inputs(p_ref, args.index, args.index_db)
+    cache = cache_spec(args)
+    job = partial(score_one, p_out=p_out, wl=wl, ww=ww, cache=cache)
+    load = partial(load_uncached, p_out=p_out, wl=wl, ww=ww, cache=cache)
+    for r, row, err in map_slices(job, refs, workers=args.workers,
+                                  load=load, prefetch=args.prefetch):
         stem = r.stem
-
-        ref01 = load_ref01(r, wl, ww)
-
-        cla_path  = p_out / f"{stem}_clahe.npy"
-        ngc_path  = p_out / f"{stem}_ngcclahe.npy"
-        prop_path = p_out / f"{stem}_proposed.npy"
-
-        if not (cla_path.exists() and ngc_path.exists() and prop_path.exists()):
+        if err:
+            print(f"# failed {stem}: {err}")
+            continue
+        if row is None:
             print(f"# skip {stem}: some outputs missing")
             continue
 
-        cla  = np.load(cla_path).astype(np.float32)
-        ngc  = np.load(ngc_path).astype(np.float32)
-        prop = np.load(prop_path).astype(np.float32)
-
-        # ensure all are in [0,1]
-        for x in (cla, ngc, prop):
-            x[x < 0.0] = 0.0
-            x[x > 1.0] = 1.0
-
-        u_cla  = uiqi(ref01, cla)
-        s_cla  = ssim01(ref01, cla)
-        f_cla  = fsim(ref01, cla)
-
-        u_ngc  = uiqi(ref01, ngc)
-        s_ngc  = ssim01(ref01, ngc)
-        f_ngc  = fsim(ref01, ngc)
-
-        u_prop = uiqi(ref01, prop)
-        s_prop = ssim01(ref01, prop)
-        f_prop = fsim(ref01, prop)
-
-        rows.append(
-            (u_cla, s_cla, f_cla, u_ngc, s_ngc, f_ngc, u_prop, s_prop, f_prop)
-        )
+        rows.append(row)
         stems.append(stem)
 
+        (u_cla, s_cla, f_cla, u_ngc, s_ngc, f_ngc, u_prop, s_prop, f_prop) = row
         print(
             f"{stem},{u_cla:.4f},{s_cla:.4f},{f_cla:.4f},"
             f"{u_ngc:.4f},{s_ngc:.4f},{f_ngc:.4f},"
@@ -147,49 +203,50 @@ def main():
     # ------------------------------------------------------------------
     # Line plots for all 50 images (UIQI / SSIM / FSIM)
     # ------------------------------------------------------------------
-    fig_dir = p_out / "figs"
-    fig_dir.mkdir(exist_ok=True)
-
-    idx = np.arange(len(stems))
-
-    # UIQI plot
-    plt.figure(figsize=(10, 4))
-    plt.plot(idx, rows[:, 0], marker="o", label="CLAHE")
-    plt.plot(idx, rows[:, 3], marker="o", label="NGC-CLAHE")
-    plt.plot(idx, rows[:, 6], marker="o", label="Proposed (NW-NGC-CLAHE)")
-    plt.xlabel("Slice index")
-    plt.ylabel("UIQI")
-    plt.title("UIQI per slice")
-    plt.grid(True, alpha=0.3)
-    plt.legend()
-    plt.tight_layout()
-    plt.savefig(fig_dir / "uiqi_all_slices.png", dpi=300)
-
-    # SSIM plot
-    plt.figure(figsize=(10, 4))
-    plt.plot(idx, rows[:, 1], marker="o", label="CLAHE")
-    plt.plot(idx, rows[:, 4], marker="o", label="NGC-CLAHE")
-    plt.plot(idx, rows[:, 7], marker="o", label="Proposed (NW-NGC-CLAHE)")
-    plt.xlabel("Slice index")
-    plt.ylabel("SSIM")
-    plt.title("SSIM per slice")
-    plt.grid(True, alpha=0.3)
-    plt.legend()
-    plt.tight_layout()
-    plt.savefig(fig_dir / "ssim_all_slices.png", dpi=300)
-
-    # FSIM plot
-    plt.figure(figsize=(10, 4))
-    plt.plot(idx, rows[:, 2], marker="o", label="CLAHE")
-    plt.plot(idx, rows[:, 5], marker="o", label="NGC-CLAHE")
-    plt.plot(idx, rows[:, 8], marker="o", label="Proposed (NW-NGC-CLAHE)")
-    plt.xlabel("Slice index")
-    plt.ylabel("FSIM")
-    plt.title("FSIM per slice")
-    plt.grid(True, alpha=0.3)
-    plt.legend()
-    plt.tight_layout()
-    plt.savefig(fig_dir / "fsim_all_slices.png", dpi=300)
+    with trace.span("plot"):
+        fig_dir = p_out / "figs"
+        fig_dir.mkdir(exist_ok=True)
+
+        idx = np.arange(len(stems))
+
+        # UIQI plot
+        plt.figure(figsize=(10, 4))
+        plt.plot(idx, rows[:, 0], marker="o", label="CLAHE")
+        plt.plot(idx, rows[:, 3], marker="o", label="NGC-CLAHE")
+        plt.plot(idx, rows[:, 6], marker="o", label="Proposed (NW-NGC-CLAHE)")
+        plt.xlabel("Slice index")
+        plt.ylabel("UIQI")
+        plt.title("UIQI per slice")
+        plt.grid(True, alpha=0.3)
+        plt.legend()
+        plt.tight_layout()
+        plt.savefig(fig_dir / "uiqi_all_slices.png", dpi=300)
+
+        # SSIM plot
+        plt.figure(figsize=(10, 4))
+        plt.plot(idx, rows[:, 1], marker="o", label="CLAHE")
+        plt.plot(idx, rows[:, 4], marker="o", label="NGC-CLAHE")
+        plt.plot(idx, rows[:, 7], marker="o", label="Proposed (NW-NGC-CLAHE)")
+        plt.xlabel("Slice index")
+        plt.ylabel("SSIM")
+        plt.title("SSIM per slice")
+        plt.grid(True, alpha=0.3)
+        plt.legend()
+        plt.tight_layout()
+        plt.savefig(fig_dir / "ssim_all_slices.png", dpi=300)
+
+        # FSIM plot
+        plt.figure(figsize=(10, 4))
+        plt.plot(idx, rows[:, 2], marker="o", label="CLAHE")
+        plt.plot(idx, rows[:, 5], marker="o", label="NGC-CLAHE")
+        plt.plot(idx, rows[:, 8], marker="o", label="Proposed (NW-NGC-CLAHE)")
+        plt.xlabel("Slice index")
+        plt.ylabel("FSIM")
+        plt.title("FSIM per slice")
+        plt.grid(True, alpha=0.3)
+        plt.legend()
+        plt.tight_layout()
+        plt.savefig(fig_dir / "fsim_all_slices.png", dpi=300)
 
     print(f"Saved line plots to {fig_dir}")
 
@@ -0,0 +1,219 @@
+import argparse
+import csv
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+
+from src.io.dicom_png import WINDOWS, parse_windows, read_windowed01_multi
+from src.enhan.graph import Executor, node, source
+from src.enhan.methods import METHODS, LABELS, build
+from src.metrics.engine import MetricsEngine
+from src.io.index import add_index_arg, list_inputs, list_series
+from src.io.prefetch import BackgroundWriter
+from src.io.volume_store import SeriesWriter, add_store_args
+from src.utils import trace
+from src.utils.parallel import add_workers_arg, map_slices
+
+METRICS = MetricsEngine.names
+
+
+def run_one(p, names, modes, strength, version, synth_dirs, out_dirs, store=False,
+            data=None, save=np.save):
+    """
+    Window -> degrade -> enhance -> score for one reference slice, in memory.
+
+    The reference is decoded once and fanned out to every window preset in
+    ``modes``; the windowed reference, the degraded image and every method
+    output only touch disk if a save folder is set.
+
+    Returns
+    -------
+    dict
+        ``{mode: [UIQI, SSIM, FSIM per method...]}``; with ``store`` a pair
+        ``(rows, {mode: {"synth" or method: image}})`` for the parent to
+        append to its stores.
+    """
+    rows, keep = {}, {}
+    wins = read_windowed01_multi(p, modes) if data is None else data
+    for mode, ref01 in wins.items():
+        ref = source()
+        deg = node("degrade", ref, strength=strength, version=version)
+        targets = build(names, deg)
+        targets["_deg"] = deg
+        res = Executor({ref: ref01}).run(targets)
+
+        deg01 = res.pop("_deg")
+        kept = keep[mode] = {}
+        if synth_dirs:
+            if store:
+                kept["synth"] = deg01.astype(np.float32)
+            else:
+                save(synth_dirs[mode] / f"{p.stem}.npy", deg01.astype(np.float32))
+
+        imgs = []
+        for name, img in res.items():
+            img = np.clip(img.astype(np.float32), 0.0, 1.0)
+            if out_dirs:
+                if store:
+                    kept[name] = img
+                else:
+                    save(out_dirs[mode] / f"{p.stem}_{name}.npy", img)
+            imgs.append(img)
+        rows[mode] = MetricsEngine(ref01).score_stack(imgs).ravel().tolist()
+    return (rows, keep) if store else rows
+
+
+def main():
+    ap = argparse.ArgumentParser(
+        description="fused window -> degrade -> enhance -> metrics pipeline"
+    )
+    ap.add_argument("--src", default="data/real", help="clean reference images (PNG/DICOM)")
+    ap.add_argument(
+        "--csv",
+        default="data/outputs/metrics_per_slice.csv",
+        help="where to write per-slice metrics",
+    )
+    ap.add_argument(
+        "--mode",
+        default="soft",
+        help="CT window preset(s): soft, lung, bone, subdural, a comma list "
+             "or 'all'; each slice is decoded once for all of them",
+    )
+    ap.add_argument(
+        "--strength",
+        default="strong",
+        choices=["mild", "medium", "strong"],
+        help="amount of synthetic contrast reduction",
+    )
+    ap.add_argument(
+        "--degrade",
+        type=int,
+        default=1,
+        choices=[1, 2],
+        help="degradation model (1 = utils.degrade, 2 = utils.degrade_v2)",
+    )
+    ap.add_argument(
+        "--methods",
+        default=",".join(METHODS),
+        help="comma-separated subset of: " + ", ".join(METHODS),
+    )
+    ap.add_argument("--save-synth", default=None, help="optionally keep degraded .npy here")
+    ap.add_argument("--save-outputs", default=None, help="optionally keep enhanced .npy here")
+    add_workers_arg(ap)
+    add_index_arg(ap)
+    add_store_args(ap)
+    trace.add_trace_args(ap)
+    args = ap.parse_args()
+    trace.start(args)
+
+    names = [m.strip() for m in args.methods.split(",") if m.strip()]
+    unknown = [m for m in names if m not in METHODS]
+    if unknown:
+        ap.error(f"unknown method(s): {', '.join(unknown)}")
+
+    try:
+        modes = parse_windows(args.mode)
+    except ValueError as e:
+        ap.error(str(e))
+    multi = len(modes) > 1
+
+    def per_mode(folder):
+        # one preset keeps the flat layout; fan-out gets folder/<preset>/
+        if not folder:
+            return None
+        dirs = {m: Path(folder) / m if multi else Path(folder) for m in modes}
+        for d in dirs.values():
+            d.mkdir(parents=True, exist_ok=True)
+        return dirs
+
+    synth_dirs = per_mode(args.save_synth)
+    out_dirs = per_mode(args.save_outputs)
+
+    header = ["stem"] + [f"{m}_{LABELS.get(n, n)}" for n in names for m in METRICS]
+    print(", ".join(header))
+
+    src = Path(args.src)
+    paths = list_inputs(src, args.index, args.index_db)
+    # serial runs write .npy files on a background thread
+    bg = None
+    if args.workers == 1 and not args.store and (synth_dirs or out_dirs):
+        bg = BackgroundWriter()
+    job = partial(
+        run_one, names=names, modes=modes, strength=args.strength,
+        version=args.degrade, synth_dirs=synth_dirs, out_dirs=out_dirs,
+        store=args.store, **({"save": bg.save} if bg else {}),
+    )
+    load = partial(read_windowed01_multi, names=modes)
+
+    # --store: synth.vol / <method>.vol stores per preset folder, one per series
+    stores, sid = {}, {}
+    if args.store:
+        series = list_series(src, args.index, args.index_db)
+        paths = [p for group in series for p in group]
+        sid = {p: i for i, group in enumerate(series) for p in group}
+        for m in modes:
+            ws = stores[m] = {}
+            if synth_dirs:
+                ws["synth"] = SeriesWriter(synth_dirs[m], "synth", compress=args.compress)
+            if out_dirs:
+                for n in names:
+                    ws[n] = SeriesWriter(out_dirs[m], n, compress=args.compress)
+
+    csv_path = Path(args.csv)
+    csv_path.parent.mkdir(parents=True, exist_ok=True)
+    csv_paths = {
+        m: csv_path.with_name(f"{csv_path.stem}_{m}{csv_path.suffix}") if multi else csv_path
+        for m in modes
+    }
+    files = {m: open(csv_paths[m], "w", newline="") for m in modes}
+    writers = {m: csv.writer(f) for m, f in files.items()}
+    rows = {m: [] for m in modes}
+    try:
+        for w in writers.values():
+            w.writerow(header)
+        for p, res, err in map_slices(job, paths, workers=args.workers,
+                                      load=load, prefetch=args.prefetch):
+            if err:
+                print(f"# failed {p.name}: {err}")
+                continue
+            if args.store:
+                res, keep = res
+                try:
+                    for m, kept in keep.items():
+                        for key, img in kept.items():
+                            stores[m][key].append(p.stem, img, series=sid[p])
+                except Exception as e:
+                    print(f"# failed {p.name}: {type(e).__name__}: {e}")
+                    continue
+            for m, row in res.items():
+                rows[m].append(row)
+                writers[m].writerow([p.stem] + row)
+                tag = f"{p.stem}[{m}]" if multi else p.stem
+                print(tag + "," + ",".join(f"{v:.4f}" for v in row))
+    finally:
+        for f in files.values():
+            f.close()
+        for ws in stores.values():
+            for w in ws.values():
+                w.close()
+    if bg:
+        bg.close()
+
+    if not any(rows.values()):
+        print("\nNo rows collected – check the --src folder.")
+        return
+
+    for m in modes:
+        if not rows[m]:
+            continue
+        mean_vals = np.array(rows[m], dtype=np.float32).mean(axis=0)
+        print(f"\nMeans over images (UIQI/SSIM/FSIM), window {m} {WINDOWS[m]}:")
+        for i, n in enumerate(names):
+            v = mean_vals[3 * i:3 * i + 3]
+            print(f"{LABELS.get(n, n):<8} {v[0]:.4f} {v[1]:.4f} {v[2]:.4f}")
+        print(f"Saved per-slice metrics to {csv_paths[m]}")
+
+
+if __name__ == "__main__":
+    main()
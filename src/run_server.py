@@ -0,0 +1,493 @@
+"""
+Local enhancement server for on-demand, per-slice use (e.g. from a viewer).
+
+``serve`` starts an HTTP server on localhost (or on a Unix socket) in
+front of a pool of worker processes. Each worker imports the enhancers
+and runs every method once on a small image at startup, so the first
+request already finds warm code paths. Each slice runs through the same
+stage graph as in ``run_methods`` (``methods.build_slice``), so the
+output is identical to that of ``run_methods`` with the same settings.
+Requests arriving together are micro-batched: the batcher collects them
+for up to ``--batch-ms`` (and for as long as every worker is busy) and
+hands the slices of the same method and settings to a worker as one task.
+This only saves round trips to the pool; the worker still enhances each
+slice on its own.
+
+Endpoints::
+
+    POST /enhance?method=proposed&mode=soft   body: DICOM file or .npy array
+    GET  /stats                               latency percentiles (JSON)
+    GET  /health
+
+``/enhance`` parameters: ``method`` (a ``METHODS`` key), ``mode`` (window
+preset) or ``wl`` / ``ww``, ``bits`` (CLAHE grey-level depth, one of
+``BITS``) and, for ``.npy`` bodies, ``kind``: ``npy`` for [0,1] (or 0-255)
+images as ``run_methods`` reads them, ``hu`` for Hounsfield units, ``pct``
+for any grey range (percentile window). DICOM bodies are sent as
+``Content-Type: application/dicom`` or recognised by their preamble. The
+response is the enhanced slice as a float32 ``.npy``, with the size of
+the batch it ran in and the server-side latency in the ``X-Batch-Size``
+and ``X-Latency-Ms`` headers.
+
+``load`` is a matching client: it sends the slices of a folder from
+``--concurrency`` threads and prints client-side latency percentiles,
+throughput and the server's ``/stats``. Both run offline on localhost.
+"""
+import argparse
+import http.client
+import io
+import json
+import os
+import queue
+import socket
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import cycle
+from multiprocessing import Pool
+from socketserver import ThreadingMixIn, UnixStreamServer
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from src.enhan.graph import Executor
+from src.enhan.methods import METHODS, build_slice
+from src.io.dicom_png import WINDOWS, is_dicom, read_dicom_hu, read_gray01
+from src.io.index import list_inputs
+from src.utils.parallel import init_worker
+
+KINDS = ("npy", "hu", "pct")
+BITS = (8, 10, 12, 14, 16)   # as run_methods --bits
+PERCENTILES = (50, 90, 99)
+
+
+# ---------------------------------------------------------------------------
+# workers
+# ---------------------------------------------------------------------------
+
+def warm_worker(threads=1):
+    """Pool initializer: pin threads and run every method once."""
+    init_worker(threads)
+    src, targets = build_slice(list(METHODS))
+    Executor({src: np.linspace(0, 1, 64 * 64, dtype=np.float32).reshape(64, 64)}).run(targets)
+
+
+def enhance_batch(name, slices, kind="npy", wl=40, ww=400, bits=8):
+    """One micro-batch in a worker: raw slices -> float32 outputs, each as in ``run_methods``."""
+    t0 = time.perf_counter()
+    src, targets = build_slice([name], kind, wl, ww, bits)
+    out = [Executor({src: raw}).run(targets)[name].astype(np.float32) for raw in slices]
+    return out, time.perf_counter() - t0
+
+
+# ---------------------------------------------------------------------------
+# batching and statistics
+# ---------------------------------------------------------------------------
+
+class Stats:
+    """Latencies of recent requests per method, batch sizes and counts."""
+
+    def __init__(self, keep=10000):
+        self.lock = threading.Lock()
+        self.latency = defaultdict(lambda: deque(maxlen=keep))
+        self.compute = defaultdict(lambda: deque(maxlen=keep))
+        self.batches = Counter()
+        self.requests = Counter()
+        self.errors = 0
+        self.started = time.time()
+
+    def add_batch(self, name, n, seconds):
+        with self.lock:
+            self.batches[n] += 1
+            self.compute[name].append(seconds)
+
+    def add_request(self, name, seconds):
+        with self.lock:
+            self.requests[name] += 1
+            self.latency[name].append(seconds)
+
+    def add_error(self):
+        with self.lock:
+            self.errors += 1
+
+    def snapshot(self):
+        with self.lock:
+            lat = {n: list(v) for n, v in self.latency.items()}
+            comp = {n: list(v) for n, v in self.compute.items()}
+            out = {
+                "uptime_s": round(time.time() - self.started, 1),
+                "requests": dict(self.requests),
+                "errors": self.errors,
+                "batch_sizes": {str(k): v for k, v in sorted(self.batches.items())},
+            }
+        out["latency_ms"] = {n: summary_ms(v) for n, v in lat.items()}
+        out["batch_compute_ms"] = {n: summary_ms(v) for n, v in comp.items()}
+        return out
+
+
+def summary_ms(seconds):
+    """Count, mean, percentiles and max of a list of durations, in ms."""
+    ms = np.asarray(seconds, dtype=np.float64) * 1e3
+    if not len(ms):
+        return {"n": 0}
+    out = {"n": len(ms), "mean": round(float(ms.mean()), 2)}
+    for q, v in zip(PERCENTILES, np.percentile(ms, PERCENTILES)):
+        out[f"p{q}"] = round(float(v), 2)
+    out["max"] = round(float(ms.max()), 2)
+    return out
+
+
+class Batcher:
+    """
+    Collects submitted slices into per-(method, settings) batches and runs
+    each batch on the pool as one task.
+
+    A batch closes ``batch_s`` after its first request, when it holds
+    ``max_batch`` slices, or - if every worker is busy at that point - as
+    soon as one frees up, so a loaded server batches more.
+    """
+
+    def __init__(self, pool, workers, stats, batch_s=0.002, max_batch=16):
+        self.pool = pool
+        self.workers = workers
+        self.stats = stats
+        self.batch_s = batch_s
+        self.max_batch = max(int(max_batch), 1)
+        self.q = queue.Queue()
+        self.idle = threading.Condition()
+        self.inflight = 0
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, name, raw, kind="npy", wl=40, ww=400, bits=8):
+        """Future of ``(enhanced slice, batch size)``."""
+        fut = Future()
+        self.q.put(((name, kind, wl, ww, bits), raw, fut))
+        return fut
+
+    def _collect(self):
+        batch = [self.q.get()]
+        deadline = time.perf_counter() + self.batch_s
+        while len(batch) < self.max_batch:
+            wait = deadline - time.perf_counter()
+            if wait <= 0:
+                with self.idle:
+                    busy = self.inflight >= self.workers
+                if not busy:
+                    break
+                wait = 0.001
+            try:
+                batch.append(self.q.get(timeout=wait))
+            except queue.Empty:
+                pass
+        return batch
+
+    def _run(self):
+        while True:
+            groups = defaultdict(list)
+            for key, img, fut in self._collect():
+                groups[key].append((img, fut))
+            for (name, *settings), items in groups.items():
+                with self.idle:
+                    while self.inflight >= self.workers:
+                        self.idle.wait()
+                    self.inflight += 1
+                slices = [img for img, _ in items]
+                futs = [f for _, f in items]
+                self.pool.apply_async(
+                    enhance_batch, (name, slices, *settings),
+                    callback=lambda res, n=name, fs=futs: self._done(n, fs, res),
+                    error_callback=lambda e, fs=futs: self._failed(fs, e),
+                )
+
+    def _release(self):
+        with self.idle:
+            self.inflight -= 1
+            self.idle.notify()
+
+    def _done(self, name, futs, res):
+        out, seconds = res
+        self._release()
+        self.stats.add_batch(name, len(futs), seconds)
+        for f, img in zip(futs, out):
+            f.set_result((img, len(futs)))
+
+    def _failed(self, futs, e):
+        self._release()
+        for f in futs:
+            f.set_exception(e)
+
+
+# ---------------------------------------------------------------------------
+# HTTP
+# ---------------------------------------------------------------------------
+
+def decode(body, query, content_type=""):
+    """Request body and query -> ``(raw slice, kind, wl, ww)``."""
+    mode = query.get("mode", "soft")
+    if mode not in WINDOWS:
+        raise ValueError(f"unknown window preset {mode!r}; choose from {', '.join(WINDOWS)}")
+    wl, ww = WINDOWS[mode]
+    wl = float(query.get("wl", wl))
+    ww = float(query.get("ww", ww))
+    if content_type == "application/dicom" or body[128:132] == b"DICM":
+        raw, kind = read_dicom_hu(io.BytesIO(body)), "hu"
+    else:
+        try:
+            raw = np.load(io.BytesIO(body), allow_pickle=False)
+        except (ValueError, EOFError, OSError):
+            raise ValueError("invalid .npy payload") from None
+        kind = query.get("kind", "npy")
+        if kind not in KINDS:
+            raise ValueError(f"unknown kind {kind!r}; choose from {', '.join(KINDS)}")
+    if raw.ndim != 2:
+        raise ValueError(f"expected a 2D slice, got shape {raw.shape}")
+    return raw, kind, wl, ww
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, code, body, content_type="application/json", headers=()):
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in headers:
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _json(self, code, obj):
+        self._reply(code, json.dumps(obj).encode() + b"\n")
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == "/health":
+            self._json(200, {"ok": True, "methods": list(METHODS)})
+        elif path == "/stats":
+            self._json(200, self.server.stats.snapshot())
+        else:
+            self._json(404, {"error": f"no such endpoint {path}"})
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if url.path != "/enhance":
+            self._json(404, {"error": f"no such endpoint {url.path}"})
+            return
+        t0 = time.perf_counter()
+        stats = self.server.stats
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        name = query.get("method", "proposed")
+        try:
+            if name not in METHODS:
+                raise ValueError(f"unknown method {name!r}; choose from {', '.join(METHODS)}")
+            bits = query.get("bits", "8")
+            if not bits.isdigit() or int(bits) not in BITS:
+                raise ValueError(f"unsupported bits {bits!r}; choose from {', '.join(map(str, BITS))}")
+            raw, kind, wl, ww = decode(body, query, self.headers.get("Content-Type", ""))
+        except ValueError as e:
+            stats.add_error()
+            self._json(400, {"error": str(e)})
+            return
+        except Exception as e:
+            stats.add_error()
+            self._json(400, {"error": f"{type(e).__name__}: {e}"})
+            return
+        try:
+            out, n = self.server.batcher.submit(name, raw, kind, wl, ww, int(bits)).result()
+        except Exception as e:
+            stats.add_error()
+            self._json(500, {"error": f"{type(e).__name__}: {e}"})
+            return
+        seconds = time.perf_counter() - t0
+        stats.add_request(name, seconds)
+        buf = io.BytesIO()
+        np.save(buf, out)
+        self._reply(200, buf.getvalue(), "application/x-npy",
+                    [("X-Batch-Size", str(n)), ("X-Latency-Ms", f"{seconds * 1e3:.2f}")])
+
+
+class TCPHTTPServer(ThreadingHTTPServer):
+    request_queue_size = 128    # the default 5 refuses bursts of clients
+
+
+class UnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def get_request(self):
+        conn, _ = super().get_request()
+        return conn, ("unix", 0)    # handlers expect a (host, port) address
+
+
+def serve(args):
+    workers = args.workers or os.cpu_count()
+    stats = Stats()
+    pool = Pool(workers, initializer=warm_worker, initargs=(args.threads,))
+    # one round trip per worker: the pool is up and warm before we listen
+    pool.map(time.sleep, [0.05] * workers, chunksize=1)
+    if args.unix:
+        if os.path.exists(args.unix):
+            os.unlink(args.unix)
+        server = UnixHTTPServer(args.unix, Handler)
+        where = args.unix
+    else:
+        server = TCPHTTPServer((args.host, args.port), Handler)
+        where = f"http://{args.host}:{server.server_address[1]}"
+    server.stats = stats
+    server.batcher = Batcher(pool, workers, stats, batch_s=args.batch_ms / 1e3,
+                             max_batch=args.max_batch)
+    print(f"serving {', '.join(METHODS)} on {where} ({workers} warm workers)", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        pool.terminate()
+        if args.unix and os.path.exists(args.unix):
+            os.unlink(args.unix)
+
+
+# ---------------------------------------------------------------------------
+# load client
+# ---------------------------------------------------------------------------
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path, timeout=60):
+        super().__init__("localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+def connect(args):
+    if args.unix:
+        return UnixHTTPConnection(args.unix)
+    return http.client.HTTPConnection(args.host, args.port, timeout=60)
+
+
+def request_bodies(src):
+    """(name, body, content type, kind) per input of ``src``, as ``run_methods`` reads them."""
+    out = []
+    for p in list_inputs(src):
+        if p.suffix.lower() == ".npy":
+            out.append((p.name, p.read_bytes(), "application/x-npy", "npy"))
+        elif is_dicom(p):
+            out.append((p.name, p.read_bytes(), "application/dicom", "hu"))
+        else:
+            # other images go as arrays, windowed by percentiles like run_methods
+            buf = io.BytesIO()
+            np.save(buf, read_gray01(p))
+            out.append((p.name, buf.getvalue(), "application/x-npy", "pct"))
+    return out
+
+
+def load(args):
+    bodies = request_bodies(args.src)
+    if not bodies:
+        raise SystemExit(f"no .npy / PNG / DICOM slices in {args.src}")
+    jobs = queue.Queue()
+    for _, body in zip(range(args.requests), cycle(bodies)):
+        jobs.put(body)
+    latencies, failures, sizes = [], [], Counter()
+    lock = threading.Lock()
+
+    def client():
+        conn = connect(args)
+        while True:
+            try:
+                name, body, ctype, kind = jobs.get_nowait()
+            except queue.Empty:
+                break
+            t0 = time.perf_counter()
+            try:
+                conn.request("POST", f"/enhance?method={args.method}&mode={args.mode}"
+                                     f"&kind={kind}&bits={args.bits}",
+                             body=body, headers={"Content-Type": ctype})
+                resp = conn.getresponse()
+                data = resp.read()
+            except OSError as e:
+                conn.close()
+                with lock:
+                    failures.append(f"{name}: {type(e).__name__}: {e}")
+                continue
+            with lock:
+                if resp.status == 200:
+                    latencies.append(time.perf_counter() - t0)
+                    sizes[int(resp.getheader("X-Batch-Size", 1))] += 1
+                else:
+                    failures.append(f"{name}: {resp.status} {data.decode().strip()}")
+        conn.close()
+
+    t0 = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(max(args.concurrency, 1))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - t0
+
+    for f in failures[:5]:
+        print(f"# failed {f}")
+    s = summary_ms(latencies)
+    print(f"{len(latencies)} ok, {len(failures)} failed in {wall:.2f}s "
+          f"({len(latencies) / wall:.1f} slices/s), concurrency {args.concurrency}")
+    print("client latency ms: " + ", ".join(f"{k} {v}" for k, v in s.items() if k != "n"))
+    print("batch sizes seen: " + ", ".join(f"{k}x{v}" for k, v in sorted(sizes.items())))
+    conn = connect(args)
+    conn.request("GET", "/stats")
+    print(json.dumps(json.loads(conn.getresponse().read()), indent=2))
+    conn.close()
+    if failures:
+        raise SystemExit(1)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    def add_address(p):
+        p.add_argument("--host", default="127.0.0.1", help="address to listen on / connect to")
+        p.add_argument("--port", type=int, default=8765, help="TCP port (0 = any free port)")
+        p.add_argument("--unix", default=None, help="use this Unix socket path instead of TCP")
+
+    p = sub.add_parser("serve", help="run the enhancement server")
+    add_address(p)
+    p.add_argument("--workers", type=int, default=1,
+                   help="warm worker processes (0 = one per CPU core)")
+    p.add_argument("--threads", type=int, default=1,
+                   help="OpenCV threads per worker")
+    p.add_argument("--batch-ms", type=float, default=2.0,
+                   help="how long a batch waits for more requests after its first")
+    p.add_argument("--max-batch", type=int, default=16,
+                   help="most slices per batch")
+
+    p = sub.add_parser("load", help="send a folder's slices to a running server")
+    add_address(p)
+    p.add_argument("--src", default="data/synth", help="folder of .npy / PNG / DICOM slices")
+    p.add_argument("--method", default="proposed", choices=list(METHODS))
+    p.add_argument("--mode", default="soft", choices=list(WINDOWS),
+                   help="window preset for DICOM / HU input")
+    p.add_argument("--bits", type=int, default=8, choices=BITS,
+                   help="CLAHE grey-level depth (histogram bins = 2**bits)")
+    p.add_argument("--requests", type=int, default=200, help="total requests")
+    p.add_argument("--concurrency", type=int, default=8, help="client threads")
+
+    args = ap.parse_args()
+    if args.cmd == "serve":
+        serve(args)
+    else:
+        load(args)
+
+
+if __name__ == "__main__":
+    main()
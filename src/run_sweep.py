@@ -0,0 +1,135 @@
+import argparse
+import csv
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+
+from src.io.dicom_png import WINDOWS, read_windowed01
+from src.enhan.sweep import LRUCache, grid, stage_counts, sweep
+from src.metrics.engine import MetricsEngine
+from src.utils import degrade, degrade_v2, trace
+from src.io.index import add_index_arg, list_inputs
+from src.utils.parallel import add_workers_arg, map_slices
+
+METRICS = MetricsEngine.names
+
+
+def floats(s):
+    return [float(v) for v in s.split(",") if v.strip()]
+
+
+def sweep_one(p, points, wl, ww, strength, version, cache_mb, data=None):
+    """
+    Window -> degrade -> every grid point -> score, for one reference slice.
+
+    Returns
+    -------
+    (rows, counts)
+        ``rows`` holds [UIQI, SSIM, FSIM] per grid point, ``counts`` the
+        number of evaluations per stage.
+    """
+    ref01 = read_windowed01(p, wl, ww) if data is None else data
+    deg01 = (degrade_v2 if version == 2 else degrade).degrade_low_contrast(ref01, strength=strength)
+    res, ex = sweep(deg01, points, ref01=ref01, cache=LRUCache(cache_mb * 2**20))
+    return [[r[m] for m in METRICS] for r in res], stage_counts(ex)
+
+
+def main():
+    ap = argparse.ArgumentParser(
+        description="grid search over NW-GC-CLAHE parameters with shared stages"
+    )
+    ap.add_argument("--src", default="data/real", help="clean reference images (PNG/DICOM)")
+    ap.add_argument("--csv", default="data/outputs/sweep.csv", help="per-slice, per-point metrics")
+    ap.add_argument(
+        "--mode",
+        default="soft",
+        choices=list(WINDOWS),
+        help="CT window preset for DICOM references",
+    )
+    ap.add_argument(
+        "--strength",
+        default="strong",
+        choices=["mild", "medium", "strong"],
+        help="amount of synthetic contrast reduction",
+    )
+    ap.add_argument(
+        "--degrade",
+        type=int,
+        default=1,
+        choices=[1, 2],
+        help="degradation model (1 = utils.degrade, 2 = utils.degrade_v2)",
+    )
+    ap.add_argument("--gamma", type=floats, default=[0.95], help="comma list, e.g. 0.85,0.9,0.95")
+    ap.add_argument("--clip-cons", type=floats, default=[1.0], help="comma list of conservative clips")
+    ap.add_argument("--clip-agg", type=floats, default=[3.0], help="comma list of aggressive clips")
+    ap.add_argument("--alpha", type=floats, default=[0.8], help="comma list of edge weights")
+    ap.add_argument("--beta", type=floats, default=[0.6], help="comma list of noise weights")
+    ap.add_argument("--delta", type=floats, default=[0.2], help="comma list of weight offsets")
+    ap.add_argument(
+        "--rank",
+        default="SSIM",
+        choices=list(METRICS),
+        help="metric used to report the best settings",
+    )
+    ap.add_argument(
+        "--cache-mb",
+        type=int,
+        default=512,
+        help="memory budget per process for cached intermediate stages",
+    )
+    add_workers_arg(ap)
+    add_index_arg(ap)
+    trace.add_trace_args(ap)
+    args = ap.parse_args()
+    trace.start(args)
+
+    points = grid(gamma=args.gamma, clip_cons=args.clip_cons, clip_agg=args.clip_agg,
+                  alpha=args.alpha, beta=args.beta, delta=args.delta)
+    keys = list(points[0])
+    print(f"{len(points)} grid points over {', '.join(keys)}")
+
+    wl, ww = WINDOWS[args.mode]
+    src = Path(args.src)
+    paths = list_inputs(src, args.index, args.index_db)
+    job = partial(
+        sweep_one, points=points, wl=wl, ww=ww, strength=args.strength,
+        version=args.degrade, cache_mb=args.cache_mb,
+    )
+
+    csv_path = Path(args.csv)
+    csv_path.parent.mkdir(parents=True, exist_ok=True)
+    scores = []
+    with open(csv_path, "w", newline="") as f:
+        w = csv.writer(f)
+        w.writerow(["stem"] + keys + list(METRICS))
+        load = partial(read_windowed01, wl=wl, ww=ww)
+        for p, res, err in map_slices(job, paths, workers=args.workers,
+                                      load=load, prefetch=args.prefetch):
+            if err:
+                print(f"# failed {p.name}: {err}")
+                continue
+            rows, counts = res
+            for pt, row in zip(points, rows):
+                w.writerow([p.stem] + [pt[k] for k in keys] + row)
+            scores.append(rows)
+            print(f"{p.stem}: {counts.get('clahe', 0)} CLAHE passes, "
+                  f"{counts.get('ngc', 0)} NGC, {counts.get('weight', 0)} W "
+                  f"for {len(points)} points")
+
+    if not scores:
+        print("\nNo rows collected – check the --src folder.")
+        return
+
+    mean = np.array(scores, dtype=np.float64).mean(axis=0)
+    col = METRICS.index(args.rank)
+    order = np.argsort(-mean[:, col])
+    print(f"\nBest settings by mean {args.rank} over {len(scores)} images (UIQI/SSIM/FSIM):")
+    for i in order[:5]:
+        pt = ", ".join(f"{k}={points[i][k]}" for k in keys)
+        print(f"{pt}: {mean[i, 0]:.4f} {mean[i, 1]:.4f} {mean[i, 2]:.4f}")
+    print(f"Saved sweep metrics to {csv_path}")
+
+
+if __name__ == "__main__":
+    main()
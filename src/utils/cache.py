@@ -0,0 +1,228 @@
+"""
+Content-addressed cache for enhanced images and metric rows.
+
+A result is keyed by what it was computed from: the digest of the input
+(file bytes or array bytes), the method or stage name, the canonical
+parameter dict and ``code_version()``, a digest of the library sources
+(``src/enhan``, ``src/io``, ``src/metrics``, ``src/utils``). Changing any of
+them gives a new key, so stale entries are never returned; they simply
+age out.
+
+Entries live under ``root/<key[:2]>/<key>.npy`` (arrays) or ``.json``
+(anything JSON-serialisable), with a small SQLite table of sizes and
+last-use times. When the total exceeds ``max_bytes`` the least recently
+used entries are deleted. Several worker processes can share one cache.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+
+SRC = Path(__file__).resolve().parents[1]
+_LIB_DIRS = ("enhan", "io", "metrics", "utils")
+
+
+@lru_cache(maxsize=None)
+def code_version():
+    h = hashlib.blake2b(digest_size=16)
+    for d in _LIB_DIRS:
+        for p in sorted((SRC / d).rglob("*.py")):
+            h.update(p.relative_to(SRC).as_posix().encode())
+            h.update(p.read_bytes())
+    return h.hexdigest()
+
+
+_FILE_DIGESTS = {}
+
+
+def file_digest(path):
+    """blake2b of a file's bytes, remembered per (path, mtime, size)."""
+    path = Path(path)
+    st = path.stat()
+    memo = (str(path.resolve()), st.st_mtime_ns, st.st_size)
+    d = _FILE_DIGESTS.get(memo)
+    if d is None:
+        h = hashlib.blake2b(digest_size=16)
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        d = _FILE_DIGESTS[memo] = h.hexdigest()
+    return d
+
+
+def array_digest(a):
+    a = np.ascontiguousarray(a)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(f"{a.dtype.str}{a.shape}".encode())
+    h.update(a.data)
+    return h.hexdigest()
+
+
+def _canonical(v):
+    if isinstance(v, dict):
+        return {str(k): _canonical(v[k]) for k in sorted(v)}
+    if isinstance(v, (list, tuple)):
+        return [_canonical(x) for x in v]
+    if isinstance(v, (np.integer, np.floating)):
+        return v.item()
+    return v
+
+
+def result_key(inputs, name, params=None, version=None):
+    """
+    Cache key for ``name`` computed from ``inputs`` with ``params``.
+
+    Parameters
+    ----------
+    inputs : str or sequence of str
+        Digests of everything the result is computed from.
+    name : str
+        Method or stage name.
+    params : dict, optional
+        Settings; nested tuples/lists/dicts are canonicalised.
+    version : str, optional
+        Defaults to ``code_version()``.
+    """
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    doc = {
+        "inputs": list(inputs),
+        "name": name,
+        "params": _canonical(params or {}),
+        "version": version or code_version(),
+    }
+    blob = json.dumps(doc, sort_keys=True, separators=(",", ":")).encode()
+    return hashlib.blake2b(blob, digest_size=20).hexdigest()
+
+
+class ResultCache:
+    """
+    Size-bounded on-disk LRU of arrays and JSON values.
+
+    Parameters
+    ----------
+    root : str or Path
+        Cache folder (created if missing).
+    max_bytes : int
+        Total size kept; least recently used entries are evicted beyond it.
+    force : bool
+        Never report hits (recompute everything) but still store results.
+    """
+
+    def __init__(self, root, max_bytes=2 * 2**30, force=False):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = int(max_bytes)
+        self.force = force
+        self.con = sqlite3.connect(str(self.root / "index.sqlite"), timeout=60)
+        with self.con:
+            self.con.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, ext TEXT, size INTEGER, used REAL)")
+            self.con.execute("CREATE INDEX IF NOT EXISTS entries_used ON entries (used)")
+
+    def _path(self, key, ext):
+        return self.root / key[:2] / f"{key}{ext}"
+
+    def _lookup(self, key):
+        row = self.con.execute("SELECT ext FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        p = self._path(key, row[0])
+        return p if p.exists() else None
+
+    def has(self, key):
+        return not self.force and self._lookup(key) is not None
+
+    def get(self, key):
+        """The stored value, or None on a miss (always None with ``force``)."""
+        if self.force:
+            return None
+        p = self._lookup(key)
+        if p is None:
+            return None
+        try:
+            if p.suffix == ".npy":
+                value = np.load(p)
+            else:
+                with open(p) as f:
+                    value = json.load(f)
+        except (OSError, ValueError):
+            return None  # evicted or half-written by another process
+        with self.con:
+            self.con.execute("UPDATE entries SET used = ? WHERE key = ?", (time.time(), key))
+        return value
+
+    def put(self, key, value):
+        ext = ".npy" if isinstance(value, np.ndarray) else ".json"
+        p = self._path(key, ext)
+        p.parent.mkdir(exist_ok=True)
+        tmp = p.with_name(f"{p.name}.{os.getpid()}.tmp")
+        if ext == ".npy":
+            with open(tmp, "wb") as f:
+                np.save(f, value)
+        else:
+            with open(tmp, "w") as f:
+                json.dump(value, f)
+        os.replace(tmp, p)
+        with self.con:
+            self.con.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                             (key, ext, p.stat().st_size, time.time()))
+        self.evict()
+
+    def nbytes(self):
+        return self.con.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def evict(self):
+        """Drop least recently used entries until the cache fits ``max_bytes``."""
+        excess = self.nbytes() - self.max_bytes
+        if excess <= 0:
+            return
+        gone = []
+        for key, ext, size in self.con.execute(
+                "SELECT key, ext, size FROM entries ORDER BY used"):
+            if excess <= 0:
+                break
+            self._path(key, ext).unlink(missing_ok=True)
+            gone.append((key,))
+            excess -= size
+        with self.con:
+            self.con.executemany("DELETE FROM entries WHERE key = ?", gone)
+
+
+_OPEN = {}
+
+
+def open_cache(spec):
+    """
+    ``ResultCache`` for a ``cache_spec`` tuple, opened once per process and
+    thread (SQLite connections are not shared); None stays None.
+    """
+    if spec is None:
+        return None
+    key = (spec, threading.get_ident())
+    c = _OPEN.get(key)
+    if c is None:
+        c = _OPEN[key] = ResultCache(*spec)
+    return c
+
+
+def add_cache_args(ap):
+    ap.add_argument("--cache-dir", default="data/cache", help="result cache folder")
+    ap.add_argument("--cache-mb", type=int, default=2048, help="result cache size limit")
+    ap.add_argument("--no-cache", action="store_true", help="neither read nor write the cache")
+    ap.add_argument("--force", action="store_true",
+                    help="recompute everything, refreshing the cache")
+
+
+def cache_spec(args):
+    """Picklable cache settings for the per-slice workers, or None."""
+    if args.no_cache:
+        return None
+    return (str(Path(args.cache_dir).resolve()), args.cache_mb * 2**20, args.force)
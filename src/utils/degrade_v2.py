@@ -1,5 +1,7 @@
 import numpy as np
+from src.utils.trace import traced
 
+@traced("degrade_v2")
 def degrade_low_contrast(img01, strength: str = "medium") -> np.ndarray:
     """
     Simulate a low-contrast CT slice without adding synthetic noise.
@@ -0,0 +1,118 @@
+"""
+Process-pool execution layer shared by the ``src.run_*`` CLIs.
+
+Each CLI wraps its per-slice work in a top-level function and hands it to
+``map_slices``. Results come back in input order, and a slice that raises
+is reported instead of aborting the whole run. In a serial run the CLI can
+also hand over its loader, so the next slices are decoded on threads while
+the current one is processed. With tracing on, each slice is timed as a
+``slice`` stage and pool workers send their stage timings back with the
+results.
+"""
+import os
+from functools import partial
+from multiprocessing import Pool
+
+import cv2
+
+from src.io.prefetch import prefetch as _prefetch
+from src.utils import trace
+
+
+def add_workers_arg(ap):
+    ap.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="worker processes (1 = serial, 0 = one per CPU core)",
+    )
+    ap.add_argument(
+        "--prefetch",
+        type=int,
+        default=4,
+        help="serial runs: slices decoded ahead on I/O threads (0 = off)",
+    )
+
+
+def init_worker(threads=1, tracing=None):
+    """
+    Per-worker setup: pin OpenCV's own thread pool so N workers do not
+    each spawn one thread per core, and follow the parent's tracing.
+    """
+    cv2.setNumThreads(threads)
+    if tracing is not None:
+        trace.enable(events=tracing)
+
+
+def _call(job):
+    fn, item = job
+    try:
+        with trace.span("slice"):
+            return fn(item), None
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+
+
+def _call_traced(job):
+    # pool side: also hand this worker's stage timings back to the parent
+    return _call(job) + (trace.drain(),)
+
+
+def map_slices(fn, items, workers=1, chunksize=None, load=None, prefetch=0):
+    """
+    Apply ``fn`` to every item, optionally across a process pool.
+
+    Parameters
+    ----------
+    fn : callable
+        Picklable (module-level) function of one item. Use
+        ``functools.partial`` to bind run options.
+    items : sequence
+        Work items, typically paths.
+    workers : int
+        Number of processes; 1 runs in-process, 0 uses all cores.
+    chunksize : int, optional
+        Items handed to a worker at a time. Defaults to roughly four
+        chunks per worker, which amortises IPC without starving the tail.
+    load : callable, optional
+        Loader of one item. With one worker and ``prefetch > 0`` it runs
+        ahead on threads and ``fn`` is called as ``fn(item, data=...)``;
+        otherwise ``fn(item)`` loads for itself.
+    prefetch : int
+        How many loaded items may wait ahead of ``fn``.
+
+    Yields
+    ------
+    (item, result, error)
+        In input order. ``error`` is ``"ExcType: message"`` if ``fn``
+        raised, else None.
+    """
+    items = list(items)
+    if workers == 0:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, len(items) or 1))
+    jobs = [(fn, it) for it in items]
+
+    if workers == 1 and load is not None and prefetch > 0:
+        for it, data, err in _prefetch(items, load, depth=prefetch):
+            if err:
+                yield it, None, err
+            else:
+                yield (it,) + _call((partial(fn, data=data), it))
+        return
+
+    if workers == 1:
+        for it, job in zip(items, jobs):
+            yield (it,) + _call(job)
+        return
+
+    if chunksize is None:
+        chunksize = max(1, len(items) // (workers * 4))
+    tracing = trace.enabled()
+    call = _call_traced if tracing else _call
+    initargs = (1, trace.events() if tracing else None)
+    with Pool(workers, initializer=init_worker, initargs=initargs) as pool:
+        for it, out in zip(items, pool.imap(call, jobs, chunksize)):
+            if tracing:
+                trace.merge(out[2])
+            yield it, out[0], out[1]
@@ -0,0 +1,128 @@
+"""
+Counting-based percentiles for percentile windowing.
+
+``percentiles(x, (2, 98))`` returns exactly what ``np.percentile(x, 2)``
+and ``np.percentile(x, 98)`` return (default linear method), but finds the
+needed order statistics from one histogram pass instead of partitioning a
+copy of the image per call:
+
+* integer images (uint8 / uint16 PNG, stored DICOM values): a ``bincount``
+  over the value range, the order statistics are read off its cumsum;
+* float images: a fixed-bin histogram over [min, max] locates the bin of
+  each order statistic, then only the pixels of that bin are partitioned.
+  With ``exact=False`` that last step is skipped and the value is
+  interpolated inside the bin, so the error is at most one bin width,
+  ``(max - min) / bins``.
+"""
+import numpy as np
+
+BINS = 4096
+
+
+def _ranks(n, q):
+    # np.percentile's linear method for a scalar q: virtual index (n-1)*q,
+    # its neighbouring ranks and the interpolation weight
+    qf = np.true_divide(q, 100)
+    h = float((n - 1) * qf)
+    if h >= n - 1:
+        return n - 1, n - 1, 0.0
+    if h < 0:
+        return 0, 0, 0.0
+    k = int(np.floor(h))
+    return k, k + 1, h - k
+
+
+def _lerp(a, b, t):
+    # numpy's _lerp with a python-float weight (weak promotion)
+    if a.dtype.kind == "f":
+        d = b - a
+        if t >= 0.5:
+            return b - d * a.dtype.type(1 - t)
+        return a + d * a.dtype.type(t)
+    a, b = float(a), float(b)
+    d = b - a
+    return b - d * (1 - t) if t >= 0.5 else a + d * t
+
+
+def _int_counts(x):
+    lo = int(x.min())
+    v = x.astype(np.intp) - lo if lo else x
+    return np.bincount(v.ravel()), lo
+
+
+def _int_order_stats(cdf, lo, ks, dtype):
+    return (np.searchsorted(cdf, ks, side="right") + lo).astype(dtype)
+
+
+def _float_order_stats(x, ks, bins, exact):
+    x = x.ravel()
+    lo, hi = x.min(), x.max()
+    ks = np.asarray(ks)
+    if lo == hi:
+        return np.full(ks.shape, lo, dtype=x.dtype)
+    # monotone binning: x1 <= x2 always lands in bin(x1) <= bin(x2)
+    t = x - lo
+    scale = t.dtype.type(bins / (float(hi) - float(lo)))
+    if not np.isfinite(scale):
+        t, scale = t.astype(np.float64), bins / (float(hi) - float(lo))
+    t *= scale
+    idx = t.astype(np.int32)
+    np.minimum(idx, bins - 1, out=idx)
+    cnt = np.bincount(idx, minlength=bins)
+    cdf = np.cumsum(cnt)
+    b = np.searchsorted(cdf, ks, side="right")
+    r = ks - (cdf[b] - cnt[b])
+    out = np.empty(ks.shape, dtype=x.dtype)
+    if not exact:
+        w = (float(hi) - float(lo)) / bins
+        out[:] = lo + w * (b + (r + 0.5) / cnt[b])
+        return out
+    for bb in np.unique(b):
+        sel = b == bb
+        vals = x[idx == bb]
+        vals.partition(r[sel])
+        out[sel] = vals[r[sel]]
+    return out
+
+
+def percentiles(x, qs=(2, 98), bins=BINS, exact=True, levels=None):
+    """
+    ``[np.percentile(x, q) for q in qs]`` from one histogram pass.
+
+    Parameters
+    ----------
+    x : np.ndarray
+        Integer or float image (any shape; taken as a whole).
+    qs : sequence of float
+        Percentiles in [0, 100].
+    bins : int
+        Histogram bins for float input.
+    exact : bool
+        Float input only; False returns in-bin estimates (error at most
+        ``(x.max() - x.min()) / bins``) without touching the pixels again.
+    levels : np.ndarray, optional
+        Non-decreasing value of each integer level. The result is then
+        that of ``np.percentile(levels[x], q)`` (e.g. ``x`` an 8-bit image
+        and ``levels`` its float [0,1] scale) without forming ``levels[x]``.
+
+    Returns
+    -------
+    np.ndarray
+        One value per percentile; float64 for integer input, ``x.dtype``
+        (or ``levels.dtype``) for float input, as ``np.percentile``.
+    """
+    x = np.asarray(x)
+    plan = [_ranks(x.size, q) for q in qs]
+    ks = [k for k0, k1, _ in plan for k in (k0, k1)]
+    if x.dtype.kind in "ui":
+        cnt, lo = _int_counts(x)
+        v = _int_order_stats(np.cumsum(cnt), lo, ks, x.dtype)
+        out_dtype = np.float64
+        if levels is not None:
+            v = np.asarray(levels)[v]
+            out_dtype = v.dtype if v.dtype.kind == "f" else np.float64
+    else:
+        v = _float_order_stats(x, ks, bins, exact)
+        out_dtype = x.dtype
+    return np.array([_lerp(v[2 * i], v[2 * i + 1], t) for i, (_, _, t) in enumerate(plan)],
+                    dtype=out_dtype)
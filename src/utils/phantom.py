@@ -0,0 +1,119 @@
+"""
+Deterministic synthetic slices for benchmarks and smoke runs.
+
+``shepp_logan`` rasterises the modified Shepp-Logan head phantom at any
+size, in [0,1]. ``ct_phantom`` is a CT-like chest slice in HU: air, a body
+outline, two lungs, a spine and aorta, soft-tissue organs, smooth
+"anatomical" texture and white quantum noise. Both take a ``z`` position in
+[-1, 1] (the ellipses shrink towards the ends, as in a 3D phantom) and
+the CT phantom a ``seed``, so a stack is ``[ct_phantom(n, z, seed=i) ...]``
+and the same call always returns the same pixels.
+"""
+import numpy as np
+from scipy.ndimage import gaussian_filter
+
+# modified Shepp-Logan (Toft): value, semi-axes a/b, centre x/y, angle (deg)
+SHEPP_LOGAN = (
+    (1.0, 0.6900, 0.9200, 0.00, 0.0000, 0),
+    (-0.8, 0.6624, 0.8740, 0.00, -0.0184, 0),
+    (-0.2, 0.1100, 0.3100, 0.22, 0.0000, -18),
+    (-0.2, 0.1600, 0.4100, -0.22, 0.0000, 18),
+    (0.1, 0.2100, 0.2500, 0.00, 0.3500, 0),
+    (0.1, 0.0460, 0.0460, 0.00, 0.1000, 0),
+    (0.1, 0.0460, 0.0460, 0.00, -0.1000, 0),
+    (0.1, 0.0460, 0.0230, -0.08, -0.6050, 0),
+    (0.1, 0.0230, 0.0230, 0.00, -0.6060, 0),
+    (0.1, 0.0230, 0.0460, 0.06, -0.6050, 0),
+)
+
+# CT-like chest: HU (absolute for the body, added on top for inner parts)
+CT_BODY = (
+    # hu, a, b, x, y, angle, absolute
+    (40.0, 0.90, 0.62, 0.00, 0.00, 0, True),      # soft tissue
+    (-860.0, 0.30, 0.42, -0.40, 0.02, 8, True),   # right lung
+    (-860.0, 0.28, 0.40, 0.40, 0.02, -8, True),   # left lung
+    (20.0, 0.20, 0.16, 0.05, 0.18, 0, False),     # heart
+    (160.0, 0.06, 0.06, 0.10, -0.10, 0, True),    # aorta (contrast)
+    (660.0, 0.09, 0.08, 0.00, -0.48, 0, True),    # vertebral body
+    (-520.0, 0.05, 0.04, 0.00, -0.48, 0, False),  # its marrow
+    (30.0, 0.16, 0.08, -0.20, 0.45, 20, False),   # liver dome
+)
+
+
+def _grid(n):
+    c = (np.arange(n, dtype=np.float32) + 0.5) * (2.0 / n) - 1.0
+    return c[None, :], -c[:, None]   # x to the right, y up
+
+
+def _ellipse(x, y, a, b, x0, y0, deg):
+    t = np.deg2rad(deg)
+    c, s = np.float32(np.cos(t)), np.float32(np.sin(t))
+    dx, dy = x - x0, y - y0
+    u = (dx * c + dy * s) / a
+    v = (dy * c - dx * s) / b
+    return u * u + v * v <= 1.0
+
+
+def _zscale(z):
+    # ellipsoid cross-section: semi-axes shrink as sqrt(1 - z^2), never to 0
+    return float(np.sqrt(max(1.0 - 0.75 * z * z, 0.25)))
+
+
+def shepp_logan(n=256, z=0.0):
+    """Modified Shepp-Logan phantom, (n, n) float32 in [0,1]."""
+    x, y = _grid(n)
+    k = _zscale(z)
+    out = np.zeros((n, n), dtype=np.float32)
+    for val, a, b, x0, y0, deg in SHEPP_LOGAN:
+        out[_ellipse(x, y, a * k, b * k, x0, y0, deg)] += val
+    return np.clip(out, 0.0, 1.0)
+
+
+def ct_phantom(n=512, z=0.0, seed=0, texture=25.0, noise=12.0):
+    """
+    CT-like chest slice in HU, (n, n) float32.
+
+    Parameters
+    ----------
+    n : int
+        Size in pixels.
+    z : float
+        Position in [-1, 1] along the stack.
+    seed : int
+        Seed of the texture and noise.
+    texture, noise : float
+        Standard deviation (HU) of the smooth tissue texture and of the
+        white noise inside the body.
+    """
+    x, y = _grid(n)
+    k = _zscale(z)
+    hu = np.full((n, n), -1000.0, dtype=np.float32)
+    body = None
+    for i, (val, a, b, x0, y0, deg, absolute) in enumerate(CT_BODY):
+        s = 1.0 if i == 0 else k   # the body outline keeps its size
+        m = _ellipse(x, y, a * s, b * s, x0, y0, deg)
+        if absolute:
+            hu[m] = val
+        else:
+            hu[m] += val
+        if i == 0:
+            body = m
+    rng = np.random.default_rng(seed)
+    tex = gaussian_filter(rng.standard_normal((n, n), dtype=np.float32), sigma=n / 128.0)
+    tex *= texture / (tex.std() + 1e-8)
+    tex += rng.standard_normal((n, n), dtype=np.float32) * np.float32(noise)
+    hu[body] += tex[body]
+    return hu
+
+
+def phantom_stack(kind, n, depth):
+    """
+    ``depth`` slices of phantom ``kind`` ("shepp" in [0,1], "ct" in HU)
+    spread over z in [-0.9, 0.9], as a list.
+    """
+    zs = np.linspace(-0.9, 0.9, depth) if depth > 1 else [0.0]
+    if kind == "shepp":
+        return [shepp_logan(n, z) for z in zs]
+    if kind == "ct":
+        return [ct_phantom(n, z, seed=i) for i, z in enumerate(zs)]
+    raise ValueError(f"unknown phantom {kind!r}; choose 'shepp' or 'ct'")
@@ -0,0 +1,201 @@
+"""
+Per-stage timing for the enhancement and metrics code.
+
+Stages are marked with ``@traced()`` (functions) or ``with span("name")``
+(blocks). While tracing is off, a traced call costs one flag check and a
+``span`` returns a shared no-op context, so the hooks can stay in the hot
+paths. ``enable()`` turns on recording of every call's duration (for the
+summary table and its percentiles) and, optionally, of trace events that
+``write_trace`` saves as Chrome / Perfetto trace-event JSON.
+
+Process-pool workers record into their own tracer; ``map_slices`` ships
+each worker's records back with the slice result (``drain`` / ``merge``),
+so the parent's summary and trace cover the whole run.
+"""
+import atexit
+import functools
+import json
+import os
+import threading
+from collections import defaultdict
+from time import perf_counter_ns
+
+
+class _State:
+    enabled = False
+    events = False
+    durations = defaultdict(list)   # name -> [ns, ...]
+    records = []                    # (name, start_ns, dur_ns, pid, tid)
+
+
+_T = _State()
+
+
+def enabled():
+    return _T.enabled
+
+
+def events():
+    return _T.events
+
+
+def enable(events=True):
+    """Start recording durations, and trace events if ``events``."""
+    _T.enabled = True
+    _T.events = events
+
+
+def disable():
+    _T.enabled = False
+
+
+def reset():
+    _T.durations = defaultdict(list)
+    _T.records = []
+
+
+def _record(name, t0, t1):
+    _T.durations[name].append(t1 - t0)
+    if _T.events:
+        _T.records.append((name, t0, t1 - t0, os.getpid(), threading.get_ident()))
+
+
+class _Span:
+    __slots__ = ("name", "t0")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.t0 = perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        _record(self.name, self.t0, perf_counter_ns())
+        return False
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name):
+    """Context manager timing its block as stage ``name``."""
+    return _Span(name) if _T.enabled else _NO_SPAN
+
+
+def traced(name=None):
+    """Decorator timing every call as stage ``name`` (default: function name)."""
+    def wrap(fn):
+        label = name or fn.__name__
+
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            if not _T.enabled:
+                return fn(*args, **kwargs)
+            t0 = perf_counter_ns()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _record(label, t0, perf_counter_ns())
+        return inner
+    return wrap
+
+
+def drain():
+    """Take and clear this process's records (sent from pool workers)."""
+    if not _T.enabled:
+        return None
+    chunk = (dict(_T.durations), _T.records)
+    reset()
+    return chunk
+
+
+def merge(chunk):
+    if not chunk:
+        return
+    durations, records = chunk
+    for name, ds in durations.items():
+        _T.durations[name].extend(ds)
+    _T.records.extend(records)
+
+
+def stats():
+    """
+    ``{stage: {...}}`` with calls, total / mean / p50 / p95 / max in ms and
+    a histogram of call counts per power-of-two microsecond bucket.
+    """
+    out = {}
+    for name, ds in _T.durations.items():
+        d = sorted(ds)
+        n = len(d)
+        hist = defaultdict(int)
+        for v in d:
+            hist[1 << max(v // 1000, 1).bit_length() - 1] += 1
+        out[name] = {
+            "calls": n,
+            "total_ms": sum(d) / 1e6,
+            "mean_ms": sum(d) / n / 1e6,
+            "p50_ms": d[n // 2] / 1e6,
+            "p95_ms": d[min(n - 1, (n * 95) // 100)] / 1e6,
+            "max_ms": d[-1] / 1e6,
+            "hist_us": dict(sorted(hist.items())),
+        }
+    return out
+
+
+def summary():
+    """Table of ``stats()``, slowest total first."""
+    rows = sorted(stats().items(), key=lambda kv: -kv[1]["total_ms"])
+    lines = [f"{'stage':<22}{'calls':>7}{'total ms':>11}{'mean ms':>10}"
+             f"{'p50 ms':>9}{'p95 ms':>9}{'max ms':>9}"]
+    for name, s in rows:
+        lines.append(f"{name:<22}{s['calls']:>7}{s['total_ms']:>11.1f}{s['mean_ms']:>10.2f}"
+                     f"{s['p50_ms']:>9.2f}{s['p95_ms']:>9.2f}{s['max_ms']:>9.2f}")
+    return "\n".join(lines)
+
+
+def write_trace(path):
+    """Save recorded events as Chrome / Perfetto trace-event JSON."""
+    t0 = min((r[1] for r in _T.records), default=0)
+    events = [
+        {"name": name, "cat": "stage", "ph": "X",
+         "ts": (start - t0) / 1e3, "dur": dur / 1e3, "pid": pid, "tid": tid}
+        for name, start, dur, pid, tid in _T.records
+    ]
+    with open(path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms",
+                   "otherData": {"stats": stats()}}, f)
+
+
+def add_trace_args(ap):
+    ap.add_argument("--profile", action="store_true",
+                    help="time every stage and print a summary table at the end")
+    ap.add_argument("--trace", default=None,
+                    help="also write a Chrome/Perfetto trace-event JSON here")
+
+
+def start(args):
+    """Enable tracing for a CLI run; the summary is printed when it exits."""
+    if args.profile or args.trace:
+        enable(events=bool(args.trace))
+        atexit.register(finish, args)
+
+
+def finish(args):
+    if not enabled():
+        return
+    print("\nStage timings:")
+    print(summary())
+    if args.trace:
+        write_trace(args.trace)
+        print(f"Saved trace to {args.trace}")
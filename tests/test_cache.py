@@ -0,0 +1,29 @@
+import numpy as np
+
+from src.run_methods import cache_keys
+from src.utils.cache import result_key
+
+NAMES = ["clahe", "ngcclahe", "proposed"]
+
+
+def test_result_key_follows_params():
+    key = result_key("d" * 32, "proposed", {"bits": 8, "tile": (8, 8)}, version="v")
+    assert key == result_key("d" * 32, "proposed", {"tile": [8, 8], "bits": 8}, version="v")
+    assert key != result_key("d" * 32, "proposed", {"bits": 12, "tile": (8, 8)}, version="v")
+    assert key != result_key("d" * 32, "proposed", {"bits": 8, "tile": (4, 4)}, version="v")
+
+
+def test_cache_keys_follow_method_params(tmp_path):
+    p = tmp_path / "s0.npy"
+    np.save(p, np.linspace(0, 1, 64 * 64, dtype=np.float32).reshape(64, 64))
+    base = cache_keys(p, NAMES, 40, 400, 8)
+    assert base == cache_keys(p, NAMES, 40, 400, 8)
+    changed = {
+        "bits": cache_keys(p, NAMES, 40, 400, 12),
+        "w_level": cache_keys(p, NAMES, 40, 400, 8, w_level=1),
+        "budget_mb": cache_keys(p, NAMES, 40, 400, 8, budget_mb=64),
+    }
+    assert all(changed["bits"][n] != base[n] for n in NAMES)
+    for k in ("w_level", "budget_mb"):
+        assert changed[k]["proposed"] != base["proposed"]
+        assert changed[k]["clahe"] == base["clahe"]
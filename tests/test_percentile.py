@@ -0,0 +1,23 @@
+import numpy as np
+import pytest
+
+from src.utils.percentile import percentiles
+
+QS = (0, 2, 50, 98, 100)
+
+
+def _images():
+    rng = np.random.default_rng(0)
+    return {
+        "uint8": rng.integers(0, 256, (97, 103), dtype=np.uint8),
+        "uint16": rng.integers(0, 4096, (97, 103), dtype=np.uint16),
+        "float32": rng.standard_normal((97, 103)).astype(np.float32),
+        "constant": np.full((64, 64), 0.25, dtype=np.float32),
+    }
+
+
+@pytest.mark.parametrize("name", list(_images()))
+def test_percentiles_equal_numpy(name):
+    x = _images()[name]
+    expected = [np.percentile(x, q) for q in QS]
+    np.testing.assert_array_equal(percentiles(x, QS), expected)
@@ -0,0 +1,21 @@
+import numpy as np
+import pytest
+
+from src.enhan.nw_gc_clahe import nw_gc_clahe
+from src.enhan.tiled import block_shape, nw_gc_clahe_tiled
+from src.io.dicom_png import window_hu
+from src.utils.phantom import ct_phantom
+
+
+@pytest.fixture(scope="module")
+def img01():
+    return window_hu(ct_phantom(256), 40, 400).astype(np.float32)
+
+
+@pytest.mark.parametrize("bins", [256, 4096, 65536])
+def test_tiled_equals_in_memory(img01, bins):
+    # 1 MB cuts a 256^2 slice into 8 strips of 32 rows
+    assert block_shape(img01.shape, (8, 8), 1)[0] < img01.shape[0]
+    ref = nw_gc_clahe(img01, bins=bins)[0]
+    out = nw_gc_clahe_tiled(img01, bins=bins, budget_mb=1)
+    np.testing.assert_array_equal(out, ref)
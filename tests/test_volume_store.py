@@ -0,0 +1,31 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import numpy as np
+
+from src.io.volume_store import open_store
+
+ROOT = Path(__file__).resolve().parents[1]
+
+# appends 10 slices in chunks of 4, then dies without close()
+WRITER = """
+import os, sys
+import numpy as np
+from src.io.volume_store import VolumeWriter
+w = VolumeWriter(sys.argv[1], chunk=4)
+for i in range(10):
+    w.append(f"s{i}", np.full((8, 8), i, dtype=np.float32))
+os._exit(1)
+"""
+
+
+def test_killed_writer_keeps_complete_chunks(tmp_path):
+    path = tmp_path / "synth.vol"
+    res = subprocess.run([sys.executable, "-c", WRITER, str(path)], cwd=ROOT)
+    assert res.returncode == 1
+    s = open_store(path)
+    assert len(s) == 8
+    for i in range(8):
+        np.testing.assert_array_equal(s[f"s{i}"], np.full((8, 8), i, dtype=np.float32))
+    assert "s8" not in s